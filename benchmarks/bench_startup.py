@@ -0,0 +1,103 @@
+"""
+Measures how long the bot takes to get from a cold start to having its posts scheduled.
+
+The bot is started in a fresh interpreter against a temporary config with a cached access token.
+Any network request or import of the first-time OAuth machinery during startup is treated as a failure.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--max-ms MS]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter. Times `import main` plus scheduling every post type.
+CHILD_CODE = """
+import sys
+import time
+start = time.perf_counter()
+import requests
+
+
+def no_network(*args, **kwargs):
+    raise RuntimeError("Network request made during startup")
+
+
+requests.Session.request = no_network
+import main
+main.post_scheduler()
+elapsed = time.perf_counter() - start
+for module in ("webbrowser", "oauth_handler", "http.server"):
+    if module in sys.modules:
+        raise RuntimeError(f"{module} was imported during startup")
+print(elapsed)
+"""
+
+
+def make_config(directory: str) -> None:
+    """
+    Writes a config with a cached, still-valid access token into `directory`.
+    :param directory: The directory to run the bot in.
+    :return: None.
+    """
+    with open(os.path.join(REPO_DIR, "example_config.json"), "r") as json_file:
+        config = json.load(json_file)
+    config["refresh_token"] = "benchmark"
+    config["access_token"] = "benchmark"
+    config["access_token_expiry"] = time.time() + 3600
+    with open(os.path.join(directory, "da_config.json"), "w") as json_file:
+        json.dump(config, json_file)
+
+
+def run_once(directory: str) -> float:
+    """
+    Starts the bot once in a fresh interpreter.
+    :param directory: The directory containing the benchmark config.
+    :return: Seconds taken to import and schedule.
+    """
+    env = {**os.environ, "PYTHONPATH": REPO_DIR, "PYTHONDONTWRITEBYTECODE": "1"}
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE],
+        cwd=directory,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark bot startup time.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of cold starts to time.")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail if the median startup time exceeds this many milliseconds.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_config(directory)
+        try:
+            timings = [run_once(directory) * 1000 for _ in range(args.runs)]
+        except subprocess.CalledProcessError as exc:
+            print(f"Startup failed:\n{exc.stderr}")
+            return 1
+
+    median = statistics.median(timings)
+    print(f"Startup over {args.runs} runs: "
+          f"min {min(timings):.1f} ms, median {median:.1f} ms, max {max(timings):.1f} ms")
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"Median startup time exceeds {args.max_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
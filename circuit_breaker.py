@@ -0,0 +1,138 @@
+import threading
+import time
+from typing import Union
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a request while the circuit breaker is open.
+    """
+
+    def __init__(self, retry_at: float):
+        """
+        :param retry_at: When (as a `time.time()` timestamp) requests may be attempted again.
+        """
+        super().__init__(f"DeviantArt appears to be down. Not retrying until {time.ctime(retry_at)}")
+        self.retry_at: float = retry_at
+
+
+class CircuitBreaker:
+    """
+    Stops requests to the API during outages.
+    After `failure_threshold` consecutive failures (server errors, timeouts, DNS failures), the circuit opens
+    and requests are refused for `reset_timeout` seconds. After that, a single probe request is let through
+    (half-open). If it succeeds, the circuit closes, otherwise it opens again.
+    Only the probe can close the circuit, so requests that started before it opened can't end the pause early.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    # Seconds that requests refused during a probe wait before trying again
+    PROBE_WAIT = 10
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 300):
+        """
+        :param failure_threshold: Consecutive failures before the circuit opens.
+        :param reset_timeout: Seconds to wait before probing the API again.
+        """
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.__state: str = self.CLOSED
+        # Consecutive failures while closed
+        self.__failures: int = 0
+        # When the circuit last opened
+        self.__opened_at: float = 0.0
+        # Whether the half-open probe has been handed out
+        self.__probing: bool = False
+        # The thread making the probe, and when it was handed out
+        self.__probe_owner: Union[int, None] = None
+        self.__probe_started: float = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        The current state of the circuit.
+        :return: One of `CLOSED`, `OPEN` or `HALF_OPEN`.
+        """
+        with self.__lock:
+            return self.__state
+
+    @property
+    def retry_at(self) -> float:
+        """
+        When requests may be attempted again (as a `time.time()` timestamp).
+        :return: The timestamp.
+        """
+        with self.__lock:
+            if self.__state == self.HALF_OPEN:
+                # Wait to see how the probe goes
+                return time.time() + self.PROBE_WAIT
+            return self.__opened_at + self.reset_timeout
+
+    def allow_request(self) -> bool:
+        """
+        Whether a request may be made now. In the half-open state, only the first caller gets to probe.
+        :return: True if the request may be made.
+        """
+        with self.__lock:
+            if self.__state == self.CLOSED:
+                return True
+            now = time.time()
+            if self.__state == self.OPEN and now >= self.__opened_at + self.reset_timeout:
+                self.__state = self.HALF_OPEN
+                self.__probing = False
+            # A probe that never reported back (e.g. it hit an error that isn't counted) is replaced
+            if self.__state == self.HALF_OPEN and (not self.__probing
+                                                   or now >= self.__probe_started + self.reset_timeout):
+                self.__probing = True
+                self.__probe_owner = threading.get_ident()
+                self.__probe_started = now
+                print("Probing DeviantArt to see if it is back up.")
+                return True
+            return False
+
+    def check(self) -> None:
+        """
+        Makes sure a request may be made now.
+        :return: None.
+        :raises CircuitOpenError: If it may not.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(self.retry_at)
+
+    def record_success(self) -> None:
+        """
+        Records a successful request. Closes the circuit if the request was the half-open probe.
+        :return: None.
+        """
+        with self.__lock:
+            if self.__state == self.CLOSED:
+                self.__failures = 0
+                return
+            if self.__state != self.HALF_OPEN or self.__probe_owner != threading.get_ident():
+                # Started before the circuit opened, so it says nothing about whether DeviantArt is back
+                return
+            print("DeviantArt is back up. Resuming posting.")
+            self.__state = self.CLOSED
+            self.__failures = 0
+            self.__probing = False
+            self.__probe_owner = None
+
+    def record_failure(self) -> None:
+        """
+        Records a failed request, opening the circuit if there have been too many.
+        :return: None.
+        :raises CircuitOpenError: If the circuit is now open.
+        """
+        with self.__lock:
+            self.__failures += 1
+            if self.__state == self.HALF_OPEN or self.__failures >= self.failure_threshold:
+                if self.__state != self.OPEN:
+                    print(f"DeviantArt appears to be down. Pausing requests for {self.reset_timeout} seconds.")
+                self.__state = self.OPEN
+                self.__opened_at = time.time()
+                self.__probing = False
+                self.__probe_owner = None
+            if self.__state == self.OPEN:
+                raise CircuitOpenError(self.__opened_at + self.reset_timeout)
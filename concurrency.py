@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Tuple, Union
+
+
+class AIMDLimiter:
+    """
+    Limits the number of uploads in flight, adapting the limit to how DeviantArt and the uplink are coping.
+    The limit goes up by one after a window of healthy uploads (additive increase) and is halved on
+    rate limiting, server errors, failed connections, or upload times rising above the usual (multiplicative decrease).
+    """
+
+    def __init__(self,
+                 initial: int = 1,
+                 minimum: int = 1,
+                 maximum: int = 4,
+                 latency_tolerance: float = 1.5,
+                 history_size: int = 100):
+        """
+        :param initial: The starting limit.
+        :param minimum: The lowest the limit can go.
+        :param maximum: The highest the limit can go.
+        :param latency_tolerance: How many times slower than usual (per byte) an upload can be before backing off.
+        :param history_size: How many limit changes to remember.
+        """
+        self.minimum: int = minimum
+        self.maximum: int = maximum
+        self.latency_tolerance: float = latency_tolerance
+        self.__limit: float = float(max(minimum, min(initial, maximum)))
+        self.__in_flight: int = 0
+        # Healthy uploads since the limit last changed
+        self.__successes: int = 0
+        # Smoothed seconds per byte of healthy uploads
+        self.__baseline: Union[float, None] = None
+        # When the limit was last decreased, so one slowdown isn't punished once per upload in flight
+        self.__last_decrease: float = 0.0
+        # (time, limit, reason) of each change to the limit
+        self.__history: Deque[Tuple[float, int, str]] = deque(maxlen=history_size)
+        self.__history.append((time.time(), int(self.__limit), "initial"))
+        self.__condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """
+        The current number of uploads allowed in flight.
+        :return: The limit.
+        """
+        with self.__condition:
+            return int(self.__limit)
+
+    def metrics(self) -> dict:
+        """
+        The state of the limiter, for reporting.
+        :return: The current limit, uploads in flight, and history of (time, limit, reason).
+        """
+        with self.__condition:
+            return {
+                "limit": int(self.__limit),
+                "in_flight": self.__in_flight,
+                "history": list(self.__history),
+            }
+
+    def acquire(self) -> float:
+        """
+        Waits until another upload may start.
+        :return: When the upload started (as a `time.monotonic()` timestamp), to pass to `release`.
+        """
+        with self.__condition:
+            while self.__in_flight >= int(self.__limit):
+                self.__condition.wait()
+            self.__in_flight += 1
+        return time.monotonic()
+
+    def release(self, started: float, status: int, size: int) -> None:
+        """
+        Records the outcome of an upload and lets the next one start.
+        :param started: The value returned by `acquire`.
+        :param status: The HTTP status code of the upload, or 0 if it failed to get a response.
+        :param size: The size of the upload in bytes.
+        :return: None.
+        """
+        now = time.monotonic()
+        latency = (now - started) / max(size, 1)
+        with self.__condition:
+            self.__in_flight -= 1
+            if status == 0 or status == 429 or status >= 500:
+                reason = "rate limited" if status == 429 else f"failed ({status or 'no response'})"
+                self._decrease(started, reason)
+            else:
+                slow = self.__baseline is not None and latency > self.__baseline * self.latency_tolerance
+                # Keep following the usual upload time, so a lasting change in bandwidth becomes the new normal
+                self.__baseline = latency if self.__baseline is None else 0.8 * self.__baseline + 0.2 * latency
+                if slow:
+                    self._decrease(started, "latency rising")
+                else:
+                    self.__successes += 1
+                    if self.__successes >= int(self.__limit) and self.__limit < self.maximum:
+                        self._set_limit(self.__limit + 1, "healthy")
+            self.__condition.notify_all()
+
+    def _decrease(self, started: float, reason: str) -> None:
+        """
+        Halves the limit, unless it was already decreased after this upload started. Call with the lock held.
+        :param started: When the upload started.
+        :param reason: Why the limit is being decreased.
+        :return: None.
+        """
+        if started < self.__last_decrease:
+            return
+        self.__last_decrease = time.monotonic()
+        self._set_limit(max(self.minimum, self.__limit / 2), reason)
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        """
+        Changes the limit. Call with the lock held.
+        :param limit: The new limit.
+        :param reason: Why the limit changed.
+        :return: None.
+        """
+        self.__successes = 0
+        old_limit = int(self.__limit)
+        self.__limit = limit
+        if int(limit) != old_limit:
+            self.__history.append((time.time(), int(limit), reason))
+            print(f"Upload concurrency limit changed from {old_limit} to {int(limit)} ({reason})")
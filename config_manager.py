@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import re
+from typing import List, Tuple, Union
+
+
+# Keys of a post configuration that determine when it is scheduled
+SCHEDULE_KEYS = ("type", "time", "window", "spacing", "images_per_day")
+# Ways of spacing posts across a posting window
+WINDOW_SPACINGS = ("even", "jitter")
+# Top-level keys managed by the token manager
+CREDENTIAL_KEYS = {
+    "client_id",
+    "client_secret",
+    "oauth_token",
+    "refresh_token",
+    "access_token",
+    "access_token_expiry",
+}
+
+
+def parse_bool(value: Union[str, bool], name: str) -> bool:
+    """
+    Parses a boolean configuration value, which may be a JSON boolean or a string such as "True", "1" or "yes".
+    :param value: The value from the JSON file.
+    :param name: The name of the value, for error messages.
+    :return: The value as a bool.
+    :raises ValueError: If the value is not a boolean.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in {"true", "false", "1", "0", "yes", "no", "on", "off"}:
+        return value.strip().lower() in {"true", "1", "yes", "on"}
+    raise ValueError(f"`{name}` must be true or false, not {value!r}")
+
+
+def parse_config(config: dict) -> dict:
+    """
+    Validates and normalizes a configuration loaded from JSON.
+    :param config: The decoded contents of the configuration file.
+    :return: The configuration, with `client_id` as a string.
+    :raises ValueError: If the configuration is not valid.
+    """
+    if not isinstance(config, dict):
+        raise ValueError("The configuration must be a JSON object")
+    for key in ("client_id", "client_secret", "post_config"):
+        if key not in config:
+            raise ValueError(f"The configuration is missing `{key}`")
+    if isinstance(config["client_id"], bool) or not isinstance(config["client_id"], (int, str)):
+        raise ValueError("`client_id` must be a number")
+    config["client_id"] = str(config["client_id"])
+    for key in ("debug", "debug_no_post"):
+        parse_bool(config.get(key, True), key)
+    expiry = config.get("access_token_expiry")
+    if expiry is not None and (isinstance(expiry, bool) or not isinstance(expiry, (int, float))):
+        raise ValueError("`access_token_expiry` must be a timestamp")
+    profiling = config.get("profiling", {})
+    if not isinstance(profiling, dict):
+        raise ValueError("`profiling` must be an object")
+    parse_bool(profiling.get("enabled", False), "profiling.enabled")
+    if not isinstance(profiling.get("directory", ""), str):
+        raise ValueError("`profiling.directory` must be a string")
+    retain = profiling.get("retain", 1)
+    if not isinstance(retain, int) or isinstance(retain, bool) or retain < 1:
+        raise ValueError("`profiling.retain` must be a positive integer")
+    breaker = config.get("circuit_breaker", {})
+    if not isinstance(breaker, dict):
+        raise ValueError("`circuit_breaker` must be an object")
+    for key in ("failure_threshold", "reset_timeout"):
+        value = breaker.get(key, 1)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"`circuit_breaker.{key}` must be a positive number")
+    uploads = config.get("uploads", {})
+    if not isinstance(uploads, dict):
+        raise ValueError("`uploads` must be an object")
+    max_concurrent = uploads.get("max_concurrent", 1)
+    if not isinstance(max_concurrent, int) or isinstance(max_concurrent, bool) or max_concurrent < 1:
+        raise ValueError("`uploads.max_concurrent` must be a positive integer")
+    ha = config.get("high_availability", {"lease_path": ""})
+    if not isinstance(ha, dict) or not isinstance(ha.get("lease_path"), str):
+        raise ValueError("`high_availability` must be an object with a `lease_path`")
+    lease_ttl = ha.get("lease_ttl", 1)
+    if isinstance(lease_ttl, bool) or not isinstance(lease_ttl, (int, float)) or lease_ttl <= 0:
+        raise ValueError("`high_availability.lease_ttl` must be a positive number")
+    preflight = config.get("preflight", {})
+    if not isinstance(preflight, dict):
+        raise ValueError("`preflight` must be an object")
+    for key in ("max_file_size_mb", "max_dimension", "workers"):
+        value = preflight.get(key, 1)
+        if value is None and key == "max_dimension":
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"`preflight.{key}` must be a positive number")
+    validate_post_config(config["post_config"])
+    return config
+
+
+def load_config(path: str = "da_config.json") -> dict:
+    """
+    Loads and validates the configuration file.
+    :param path: The path of the configuration file.
+    :return: The validated configuration.
+    :raises ValueError: If the configuration is not valid.
+    """
+    with open(path, "r") as json_file:
+        try:
+            config = json.load(json_file)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Unable to parse {path}: {exc}") from exc
+    return parse_config(config)
+
+
+def parse_window(window: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Parses a posting window such as "19:00-23:00". A window ending before it starts runs past midnight.
+    :param window: The window, as two HH:MM times separated by a dash.
+    :return: The (hour, minute) of the start and of the end.
+    :raises ValueError: If the window is invalid.
+    """
+    match = re.fullmatch(r"\s*([01]?\d|2[0-3]):([0-5]\d)\s*[-\u2013]\s*([01]?\d|2[0-3]):([0-5]\d)\s*", window)
+    if match is None:
+        raise ValueError(f"invalid posting window {window!r}")
+    start_hour, start_minute, end_hour, end_minute = (int(group) for group in match.groups())
+    if (start_hour, start_minute) == (end_hour, end_minute):
+        raise ValueError(f"posting window {window!r} is empty")
+    return (start_hour, start_minute), (end_hour, end_minute)
+
+
+def validate_post_config(post_config: dict) -> None:
+    """
+    Checks that the `post_config` section of the configuration is usable.
+    :param post_config: The `post_config` dictionary from the JSON file.
+    :return: None.
+    :raises ValueError: If any post type is invalid.
+    """
+    if not isinstance(post_config, dict):
+        raise ValueError("`post_config` must be an object")
+    for post_type, config in post_config.items():
+        if not isinstance(config, dict):
+            raise ValueError(f"{post_type}: configuration must be an object")
+        posting_type = str(config.get("type", "")).lower()
+        if posting_type == "daily":
+            if not isinstance(config.get("directory"), str):
+                raise ValueError(f"{post_type}: daily posts need a `directory`")
+        elif posting_type == "rotation":
+            directories = config.get("directories")
+            if not isinstance(directories, list) or not directories:
+                raise ValueError(f"{post_type}: rotation posts need a non-empty `directories` list")
+            if not isinstance(config.get("last_posted"), int):
+                raise ValueError(f"{post_type}: rotation posts need an integer `last_posted`")
+            tags = config.get("tags")
+            if isinstance(tags, list) and tags and isinstance(tags[0], list) and len(tags) != len(directories):
+                raise ValueError(f"{post_type}: rotation tag groups must match the number of directories")
+        else:
+            raise ValueError(f"{post_type}: invalid posting type {config.get('type')!r}")
+
+        images_per_day = config.get("images_per_day")
+        if not isinstance(images_per_day, int) or isinstance(images_per_day, bool) or images_per_day < 1:
+            raise ValueError(f"{post_type}: `images_per_day` must be a positive integer")
+        if "window" in config:
+            if not isinstance(config["window"], str):
+                raise ValueError(f"{post_type}: `window` must be a string such as \"19:00-23:00\"")
+            try:
+                parse_window(config["window"])
+            except ValueError as exc:
+                raise ValueError(f"{post_type}: {exc}") from None
+            if config.get("spacing", "even") not in WINDOW_SPACINGS:
+                raise ValueError(f"{post_type}: `spacing` must be one of {', '.join(WINDOW_SPACINGS)}")
+        else:
+            time_of_day = config.get("time")
+            if not isinstance(time_of_day, str) or not re.fullmatch(r"([01]?\d|2[0-3]):[0-5]\d", time_of_day):
+                raise ValueError(f"{post_type}: `time` must be in HH:MM format")
+        priority = config.get("priority", 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            raise ValueError(f"{post_type}: `priority` must be an integer")
+        max_lateness = config.get("max_lateness")
+        if max_lateness is not None and (not isinstance(max_lateness, (int, float))
+                                         or isinstance(max_lateness, bool) or max_lateness <= 0):
+            raise ValueError(f"{post_type}: `max_lateness` must be a positive number of seconds")
+        if not isinstance(config.get("galleries"), list):
+            raise ValueError(f"{post_type}: `galleries` must be a list")
+        if not isinstance(config.get("tags"), list):
+            raise ValueError(f"{post_type}: `tags` must be a list")
+        if not isinstance(config.get("artist_comments_prepend", ""), str):
+            raise ValueError(f"{post_type}: `artist_comments_prepend` must be a string")
+
+
+def diff_post_config(old: dict, new: dict) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Compares two `post_config` sections.
+    :param old: The currently applied `post_config`.
+    :param new: The newly loaded `post_config`.
+    :return: The post types that were added, removed, and changed (in that order).
+    """
+    added = [post_type for post_type in new if post_type not in old]
+    removed = [post_type for post_type in old if post_type not in new]
+    changed = [
+        post_type for post_type in new
+        if post_type in old and new[post_type] != old[post_type]
+    ]
+    return added, removed, changed
+
+
+def needs_reschedule(old: dict, new: dict) -> bool:
+    """
+    Whether a change to a single post type affects when it is scheduled.
+    Other changes (tags, directories, etc.) are picked up when the post runs.
+    :param old: The old configuration of the post type.
+    :param new: The new configuration of the post type.
+    :return: True if the post type should be rescheduled.
+    """
+    return any(old.get(key) != new.get(key) for key in SCHEDULE_KEYS)
+
+
+class ConfigWatcher:
+    """
+    Detects changes to the configuration file.
+    The file is only read and hashed when its modification time or size change,
+    so polling it frequently is cheap.
+    """
+
+    def __init__(self, path: str = "da_config.json"):
+        """
+        :param path: The path of the configuration file to watch.
+        """
+        self.path: str = path
+        # (mtime, size) of the file when last checked
+        self.__stamp: Union[Tuple[int, int], None] = self._stat()
+        # Hash of the contents when last read
+        self.__digest: Union[str, None] = self._hash()
+
+    def _stat(self) -> Union[Tuple[int, int], None]:
+        """
+        Gets the modification time and size of the configuration file.
+        :return: (mtime in ns, size) or None if the file is missing.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _hash(self) -> Union[str, None]:
+        """
+        Hashes the contents of the configuration file.
+        :return: The hex digest of the file or None if the file is missing.
+        """
+        try:
+            with open(self.path, "rb") as config_file:
+                return hashlib.sha256(config_file.read()).hexdigest()
+        except OSError:
+            return None
+
+    def poll(self) -> Union[dict, None]:
+        """
+        Checks whether the configuration file has changed.
+        :return: The new, validated configuration or None if nothing changed.
+        :raises ValueError: If the file changed but is not a valid configuration.
+        """
+        stamp = self._stat()
+        if stamp is None or stamp == self.__stamp:
+            return None
+        self.__stamp = stamp
+
+        with open(self.path, "rb") as config_file:
+            contents = config_file.read()
+        digest = hashlib.sha256(contents).hexdigest()
+        if digest == self.__digest:
+            return None
+        self.__digest = digest
+
+        try:
+            config = json.loads(contents)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Unable to parse {self.path}: {exc}") from exc
+        return parse_config(config)
@@ -1,18 +1,54 @@
 import re
 import socket
 import time
-from typing import List
+from typing import Callable, List, Union
 
 import requests
 
+from circuit_breaker import CircuitBreaker
+from concurrency import AIMDLimiter
+from dns_cache import DNSCache
+from profiling import profiled
+
 
 class OAuthError(Exception):
     pass
 
 
 class Poster:
+    API_HOST = "www.deviantart.com"
     STASH_UPLOAD_URL = "https://www.deviantart.com/api/v1/oauth2/stash/submit"
     STASH_PUBLISH_URL = "https://www.deviantart.com/api/v1/oauth2/stash/publish"
+    # (connect, read) timeouts for API requests, in seconds
+    REQUEST_TIMEOUT = (10, 300)
+
+    def __init__(self,
+                 dns_cache: Union[DNSCache, None] = None,
+                 breaker: Union[CircuitBreaker, None] = None,
+                 limiter: Union[AIMDLimiter, None] = None):
+        """
+        :param dns_cache: The DNS cache to refresh when warming up, if one is installed.
+        :param breaker: The circuit breaker to stop requests during outages, if any.
+        :param limiter: Limits how many uploads are in flight at once across threads, if given.
+        """
+        # Reuses connections (and their name resolution) between requests
+        self.session: requests.Session = requests.Session()
+        self.dns_cache: Union[DNSCache, None] = dns_cache
+        self.breaker: Union[CircuitBreaker, None] = breaker
+        self.limiter: Union[AIMDLimiter, None] = limiter
+
+    def warm_up(self) -> None:
+        """
+        Resolves the API host and opens a connection ahead of posting.
+        Failures are only reported, since posting will retry anyway.
+        :return: None.
+        """
+        if self.dns_cache is not None:
+            self.dns_cache.prefetch(self.API_HOST)
+        try:
+            self.session.head(f"https://{self.API_HOST}/", timeout=10)
+        except requests.exceptions.RequestException as exc:
+            print(f"Unable to warm up connection to {self.API_HOST}: {exc}")
 
     @staticmethod
     def _is_dns_error(exception: Exception) -> bool:
@@ -51,6 +87,7 @@ class Poster:
                     stack.append(arg)
         return False
 
+    @profiled("upload_and_submit")
     def upload_and_submit(self,
                           file_path: str,
                           token: str,
@@ -62,6 +99,7 @@ class Poster:
                           debug: bool = False,
                           back_off_time: int = 2,
                           is_ai_generated: bool | str = False,
+                          before_publish: Union[Callable[[], None], None] = None,
                           ) -> None:
         """
         Upload and submit an image to Deviantart.
@@ -75,13 +113,17 @@ class Poster:
         :param debug: Print debugging information.
         :param back_off_time: Time to wait for the rate limit to expire.
         :param is_ai_generated: If the deviation should be tagged as AI.
+        :param before_publish: Called after uploading and before publishing, e.g. to publish in order.
         :return: None
+        :raises CircuitOpenError: If DeviantArt appears to be down, rather than retrying.
         """
         if back_off_time >= 1024:
             raise RuntimeError(
                 f"Backoff time limit exceeded ({back_off_time} seconds), so ending here."
                 f"Please check previous logs for more details for the reason."
             )
+        if self.breaker is not None:
+            self.breaker.check()
         # Truncate title
         title = title[:50]
         # Upload image
@@ -114,17 +156,28 @@ class Poster:
         json_parsing_failed = False
         result = None
         upload_status = 0
+        upload_started = self.limiter.acquire() if self.limiter is not None else 0.0
         try:
-            result = requests.post(self.STASH_UPLOAD_URL, data=data, files=files)
+            result = self.session.post(self.STASH_UPLOAD_URL, data=data, files=files, timeout=self.REQUEST_TIMEOUT)
             upload_status = result.status_code
             if debug:
                 print(f"Raw {result.text=}")
             result = result.json()
         except (requests.exceptions.JSONDecodeError, requests.exceptions.InvalidJSONError):
             json_parsing_failed = True
-        except requests.exceptions.ConnectionError as exc:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
             upload_failed = True
             dns_upload_failed = self._is_dns_error(exc)
+        finally:
+            if self.limiter is not None:
+                self.limiter.release(upload_started, upload_status, len(image_file))
+
+        # Let the circuit breaker know whether DeviantArt is reachable
+        if self.breaker is not None:
+            if upload_failed or upload_status >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
 
         if json_parsing_failed or upload_failed or result.get("status", "failure") != "success":
             if json_parsing_failed:
@@ -139,7 +192,9 @@ class Poster:
                     folders,
                     is_mature,
                     debug,
-                    back_off_time ** 2
+                    back_off_time ** 2,
+                    is_ai_generated=is_ai_generated,
+                    before_publish=before_publish
                 )
                 return
             elif upload_failed:
@@ -158,7 +213,9 @@ class Poster:
                     folders,
                     is_mature,
                     debug,
-                    back_off_time
+                    back_off_time,
+                    is_ai_generated=is_ai_generated,
+                    before_publish=before_publish
                 )
                 return
             elif upload_status == 429:
@@ -173,7 +230,9 @@ class Poster:
                     folders,
                     is_mature,
                     debug,
-                    back_off_time ** 2
+                    back_off_time ** 2,
+                    is_ai_generated=is_ai_generated,
+                    before_publish=before_publish
                 )
                 return
             elif upload_status >= 500:
@@ -191,7 +250,9 @@ class Poster:
                     folders,
                     is_mature,
                     debug,
-                    back_off_time ** 2
+                    back_off_time ** 2,
+                    is_ai_generated=is_ai_generated,
+                    before_publish=before_publish
                 )
                 return
             elif result.get("status", "failure") == "error" and result.get("error", "server_error"):
@@ -218,7 +279,9 @@ class Poster:
                     folders,
                     is_mature,
                     debug,
-                    back_off_time + 2  # Don't do exponential backoff, just wait a little longer.
+                    back_off_time + 2,  # Don't do exponential backoff, just wait a little longer.
+                    is_ai_generated=is_ai_generated,
+                    before_publish=before_publish
                 )
                 return
             else:
@@ -253,13 +316,20 @@ class Poster:
             params["is_mature"] = True
             params["mature_level"] = "strict"
             params["mature_classification"] = ["nudity", "sexual"]
+        if before_publish is not None:
+            before_publish()
         publish_failed = False
         dns_publish_failed = False
         try:
-            post_result = requests.post(self.STASH_PUBLISH_URL, params=params)
-        except requests.exceptions.ConnectionError as exc:
+            post_result = self.session.post(self.STASH_PUBLISH_URL, params=params, timeout=self.REQUEST_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
             publish_failed = True
             dns_publish_failed = self._is_dns_error(exc)
+        if self.breaker is not None:
+            if publish_failed or post_result.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
         if publish_failed or post_result.status_code > 399:
             if publish_failed:
                 if dns_publish_failed:
@@ -283,7 +353,9 @@ class Poster:
                     folders,
                     is_mature,
                     debug,
-                    back_off_time
+                    back_off_time,
+                    is_ai_generated=is_ai_generated,
+                    before_publish=before_publish
                 )
                 return
             elif post_result.status_code == 400:
@@ -302,7 +374,9 @@ class Poster:
                     folders,
                     is_mature,
                     debug,
-                    back_off_time ** 2
+                    back_off_time ** 2,
+                    is_ai_generated=is_ai_generated,
+                    before_publish=before_publish
                 )
                 return
             elif upload_status == 429:
@@ -310,7 +384,8 @@ class Poster:
                 while post_result.status_code > 399 and retry_count < 20:
                     print(f"Rate limit encountered. Backing off for {back_off_time} seconds.")
                     time.sleep(back_off_time)
-                    post_result = requests.post(self.STASH_PUBLISH_URL, params=params)
+                    post_result = self.session.post(self.STASH_PUBLISH_URL, params=params,
+                                                    timeout=self.REQUEST_TIMEOUT)
                     back_off_time = back_off_time ** 2
                     if post_result.status_code > 399:
                         print(f"Retry count: {retry_count}")
@@ -324,7 +399,13 @@ class Poster:
                 while post_result.status_code > 399 and retry_count < 20:
                     print(f"Backing off for {back_off_time} seconds")
                     time.sleep(back_off_time)
-                    post_result = requests.post(self.STASH_PUBLISH_URL, params=params)
+                    post_result = self.session.post(self.STASH_PUBLISH_URL, params=params,
+                                                    timeout=self.REQUEST_TIMEOUT)
+                    if self.breaker is not None:
+                        if post_result.status_code >= 500:
+                            self.breaker.record_failure()
+                        else:
+                            self.breaker.record_success()
                     back_off_time = back_off_time ** 2
                     if post_result.status_code > 399:
                         print(f"Retry count: {retry_count}")
@@ -352,7 +433,9 @@ class Poster:
                 folders,
                 is_mature,
                 debug,
-                back_off_time ** 2
+                back_off_time ** 2,
+                is_ai_generated=is_ai_generated,
+                before_publish=before_publish
             )
             return
         else:
@@ -7,9 +7,6 @@ import secrets
 import time
 from typing import Union
 import urllib.parse as urlparse
-import webbrowser
-
-import oauth_handler
 
 
 class HTTPBasicAuth:
@@ -30,10 +27,15 @@ class DATokenManager:
     Class to keep the access __token from DeviantArt up to date
     """
 
-    def __init__(self, config: dict, debug: bool = False):
+    # Seconds before expiry that a cached `access_token` is considered stale
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, config: dict, debug: bool = False, refresh_on_init: bool = True):
         """
         :param config: A dict with keys `client_id` and `client_secret` for the DA API
         :param debug: Whether to print extra debugging information returned from the DeviantArt API.
+        :param refresh_on_init: Whether to refresh the token now rather than when it is first needed.
+        First-time authorization always happens immediately.
         """
         # A.k.a. `access_token`
         self.__token: Union[str, None] = None
@@ -49,6 +51,9 @@ class DATokenManager:
         self.__oauth_token: Union[str, None] = config.get("oauth_token", None)
         # Refresh token for OAuth stuff
         self.__refresh_token: Union[str, None] = config.get("refresh_token", None)
+        # `access_token` saved by a previous run, reused while it's still valid
+        cached_token: Union[str, None] = config.get("access_token", None)
+        cached_expiry: Union[float, None] = config.get("access_token_expiry", None)
         # PKCE verifier used while exchanging a freshly authorized code.
         self.__code_verifier: Union[str, None] = None
         # Config in the config that is not used by the token manager.
@@ -60,12 +65,21 @@ class DATokenManager:
                     {"client_id",
                      "client_secret",
                      "oauth_token",
-                     "refresh_token"}):
+                     "refresh_token",
+                     "access_token",
+                     "access_token_expiry"}):
                 self.__extra_config[key] = config[key]
 
         # Get needed tokens
         if self.__oauth_token is not None or self.__refresh_token is not None:
-            self.refresh_token()
+            if (cached_token is not None and cached_expiry is not None and
+                    time.time() < cached_expiry - self.EXPIRY_MARGIN):
+                self.__token = cached_token
+                self.token_expiry_time = cached_expiry
+                if self.__debug:
+                    print("Using cached access token")
+            elif refresh_on_init:
+                self.refresh_token()
         else:
             self.get_oauth_token()
 
@@ -75,12 +89,22 @@ class DATokenManager:
         Get the current token for the API.
         :return: The `access_token` for the API.
         """
-        if self.__token is None or time.time() >= self.token_expiry_time:
+        if self.__token is None or time.time() >= self.token_expiry_time - self.EXPIRY_MARGIN:
             self.refresh_token()
         else:
             self.save_config()
         return self.__token
 
+    def invalidate(self, token: str) -> None:
+        """
+        Treats a token that DeviantArt rejected as expired, whatever its saved expiry says, so it's refreshed next.
+        Does nothing if the token was already replaced, so uploads rejected together only refresh it once.
+        :param token: The rejected token.
+        :return: None.
+        """
+        if token == self.__token:
+            self.token_expiry_time = 0.0
+
     @property
     def extra_config(self) -> dict:
         """
@@ -102,6 +126,22 @@ class DATokenManager:
         else:
             raise RuntimeError(f"Invalid post config type or post type")
 
+    def update_credentials(self, config: dict) -> None:
+        """
+        Adopts a token saved to the configuration by another instance, if it's newer than ours.
+        :param config: The configuration as loaded from the file.
+        :return: None.
+        """
+        expiry = config.get("access_token_expiry", None)
+        if config.get("access_token", None) is None or expiry is None:
+            return
+        if self.token_expiry_time is None or expiry > self.token_expiry_time:
+            self.__token = config["access_token"]
+            self.token_expiry_time = expiry
+            self.__refresh_token = config.get("refresh_token", self.__refresh_token)
+            if self.__debug:
+                print("Using access token saved by another instance")
+
     def refresh_token(self) -> None:
         """
         Refreshes the access token for the API
@@ -178,6 +218,10 @@ class DATokenManager:
         Gets a new OAuth token for use with the API.
         :return: New token.
         """
+        # Only needed for first-time authorization, so don't slow down normal startup with them
+        import webbrowser
+        import oauth_handler
+
         # Make a nonce and PKCE challenge.
         nonce = secrets.token_urlsafe(30)
         self.__code_verifier = secrets.token_urlsafe(64)
@@ -245,4 +289,8 @@ class DATokenManager:
             "refresh_token": self.__refresh_token,
             **self.__extra_config
         }
+        # Save the current token so a restart can reuse it instead of refreshing
+        if self.__token is not None:
+            config_dict["access_token"] = self.__token
+            config_dict["access_token_expiry"] = self.token_expiry_time
         return json.dumps(config_dict, indent=4)
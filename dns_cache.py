@@ -0,0 +1,119 @@
+import socket
+import threading
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+class DNSCache:
+    """
+    Caches name resolution for a set of hosts so that a flaky resolver doesn't fail requests.
+    Expired entries are still served for a while (stale-while-revalidate) while they are
+    refreshed in the background, and are kept if the refresh fails.
+    """
+
+    def __init__(self, hosts: Iterable[str], ttl: float = 300, max_stale: float = 86400, debug: bool = False):
+        """
+        :param hosts: The host names to cache. Other lookups go straight to the resolver.
+        :param ttl: Seconds an entry is fresh for.
+        :param max_stale: Seconds after expiry that an entry may still be served.
+        :param debug: Print extra information about lookups.
+        """
+        self.hosts: Set[str] = {host.lower() for host in hosts}
+        self.ttl: float = ttl
+        self.max_stale: float = max_stale
+        self.__debug: bool = debug
+        # The original `socket.getaddrinfo`
+        self.__getaddrinfo = socket.getaddrinfo
+        # getaddrinfo arguments -> (results, time resolved)
+        self.__entries: Dict[tuple, Tuple[List[tuple], float]] = {}
+        # Keys being refreshed in the background
+        self.__refreshing: Set[tuple] = set()
+        self.__lock = threading.Lock()
+
+    def install(self) -> None:
+        """
+        Routes all name resolution in this process (including `requests`) through the cache.
+        :return: None.
+        """
+        socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self) -> None:
+        """
+        Restores the original resolver.
+        :return: None.
+        """
+        socket.getaddrinfo = self.__getaddrinfo
+
+    def _resolve(self, key: tuple) -> List[tuple]:
+        """
+        Resolves a lookup with the real resolver and caches the result.
+        :param key: The arguments to `getaddrinfo`.
+        :return: The results of `getaddrinfo`.
+        """
+        results = self.__getaddrinfo(*key)
+        with self.__lock:
+            self.__entries[key] = (results, time.monotonic())
+        return results
+
+    def _refresh_in_background(self, key: tuple) -> None:
+        """
+        Refreshes an expired entry without blocking the caller.
+        :param key: The arguments to `getaddrinfo`.
+        :return: None.
+        """
+        def refresh():
+            try:
+                self._resolve(key)
+            except OSError as exc:
+                print(f"Unable to refresh DNS entry for {key[0]}, still using the cached one: {exc}")
+            finally:
+                with self.__lock:
+                    self.__refreshing.discard(key)
+
+        with self.__lock:
+            if key in self.__refreshing:
+                return
+            self.__refreshing.add(key)
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0) -> List[tuple]:
+        """
+        Drop-in replacement for `socket.getaddrinfo`.
+        """
+        if not isinstance(host, str) or host.lower() not in self.hosts:
+            return self.__getaddrinfo(host, port, family, type, proto, flags)
+
+        key = (host.lower(), port, family, type, proto, flags)
+        with self.__lock:
+            entry = self.__entries.get(key)
+        if entry is None:
+            return self._resolve(key)
+
+        results, resolved_at = entry
+        age = time.monotonic() - resolved_at
+        if age < self.ttl:
+            return results
+        if age < self.ttl + self.max_stale:
+            if self.__debug:
+                print(f"Serving stale DNS entry for {host} ({age:.0f} seconds old)")
+            self._refresh_in_background(key)
+            return results
+        return self._resolve(key)
+
+    def prefetch(self, host: str, port: int = 443) -> None:
+        """
+        Resolves a host now so that the cache is fresh, e.g. shortly before it's needed.
+        If resolution fails, any cached entries are kept.
+        :param host: The host to resolve.
+        :param port: The port that will be connected to.
+        :return: None.
+        """
+        with self.__lock:
+            keys = [key for key in self.__entries if key[0] == host.lower() and key[1] == port]
+        if not keys:
+            keys = [(host.lower(), port, 0, socket.SOCK_STREAM, 0, 0)]
+        for key in keys:
+            try:
+                self._resolve(key)
+            except OSError as exc:
+                print(f"Unable to resolve {host} ahead of time: {exc}")
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from typing import Set, Tuple, Union
+
+
+class DrainCheckpoint:
+    """
+    Records the progress of draining a post type so it can be interrupted and resumed.
+    Images are recorded as soon as they're published and forgotten once they're removed, so an image is never
+    posted twice even if the drain is interrupted between publishing and removing it.
+    Entries are keyed by path, size and modification time, so a new image that reuses the name isn't mistaken for one.
+    """
+
+    def __init__(self, path: str, post_type: str):
+        """
+        Loads the checkpoint for a post type, or starts a new one.
+        :param path: Where the checkpoint is saved.
+        :param post_type: The post type being drained.
+        """
+        self.path: str = path
+        self.post_type: str = post_type
+        # (path, size, modification time) of images that were published but not removed yet
+        self.published: Set[Tuple[str, int, int]] = set()
+        # Images published
+        self.images: int = 0
+        # Bytes published
+        self.bytes: int = 0
+        # Seconds spent draining in previous runs
+        self.previous_seconds: float = 0.0
+        self.__started: float = time.monotonic()
+        self.__lock = threading.Lock()
+
+        try:
+            with open(path, "r") as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (OSError, json.JSONDecodeError):
+            return
+        if checkpoint.get("post_type") != post_type:
+            print(f"Ignoring checkpoint for {checkpoint.get('post_type')} in {path}")
+            return
+        self.published = {tuple(entry) for entry in checkpoint.get("published", [])}
+        self.images = checkpoint.get("images", 0)
+        self.bytes = checkpoint.get("bytes", 0)
+        self.previous_seconds = checkpoint.get("seconds", 0.0)
+        print(f"Resuming drain of {post_type}: {self.images} image(s) already posted")
+
+    @property
+    def seconds(self) -> float:
+        """
+        Total seconds spent draining, including previous runs.
+        :return: The seconds.
+        """
+        return self.previous_seconds + time.monotonic() - self.__started
+
+    @staticmethod
+    def _key(file: os.DirEntry) -> Union[Tuple[str, int, int], None]:
+        """
+        Identifies an image by its path, size and modification time.
+        :param file: The image.
+        :return: The key, or None if the image is gone.
+        """
+        try:
+            stat = os.stat(file.path)
+        except OSError:
+            return None
+        return file.path, stat.st_size, stat.st_mtime_ns
+
+    def was_published(self, file: os.DirEntry) -> bool:
+        """
+        Whether an image was published by an earlier run that was interrupted before removing it.
+        :param file: The image.
+        :return: True if it was published.
+        """
+        return self._key(file) in self.published
+
+    def record(self, file: os.DirEntry) -> None:
+        """
+        Records that an image was published and saves the checkpoint.
+        :param file: The published image.
+        :return: None.
+        """
+        key = self._key(file)
+        with self.__lock:
+            self.images += 1
+            if key is not None:
+                self.published.add(key)
+                self.bytes += key[1]
+            self.save()
+
+    def forget(self, file: os.DirEntry) -> None:
+        """
+        Forgets a published image once it's removed. This is saved along with the next change rather than now,
+        since an entry left behind can't match a new image (its size and modification time would differ).
+        :param file: The removed image.
+        :return: None.
+        """
+        with self.__lock:
+            self.published = {key for key in self.published if key[0] != file.path}
+
+    def save(self) -> None:
+        """
+        Saves the checkpoint, replacing the old one atomically.
+        :return: None.
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump({
+                "post_type": self.post_type,
+                "published": sorted(self.published),
+                "images": self.images,
+                "bytes": self.bytes,
+                "seconds": self.seconds,
+            }, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def remove(self) -> None:
+        """
+        Removes the checkpoint once the drain is finished.
+        :return: None.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def report(self, concurrency: int) -> None:
+        """
+        Prints the throughput of the drain so far.
+        :param concurrency: The current limit on uploads in flight.
+        :return: None.
+        """
+        seconds = max(self.seconds, 1e-9)
+        print(f"Drained {self.images} image(s) ({self.bytes / 2 ** 20:.1f} MiB) in {seconds:.0f} s: "
+              f"{self.images * 60 / seconds:.1f} images/min, "
+              f"{self.bytes / 2 ** 20 / seconds:.2f} MiB/s, "
+              f"upload concurrency limit {concurrency}")
@@ -0,0 +1,92 @@
+import heapq
+import itertools
+import math
+import time
+from typing import Callable, List, Tuple, Union
+
+
+class Job:
+    """
+    A posting waiting for its turn to run.
+    """
+
+    def __init__(self,
+                 name: str,
+                 action: Callable,
+                 args: tuple = (),
+                 priority: int = 0,
+                 ready_at: Union[float, None] = None,
+                 max_lateness: Union[float, None] = None):
+        """
+        :param name: What the job is, for reporting.
+        :param action: The function to run.
+        :param args: The arguments to `action`.
+        :param priority: Jobs with higher priorities run first.
+        :param ready_at: When the job was due (as a `time.time()` timestamp). Defaults to now.
+        :param max_lateness: Seconds the job may start after `ready_at`, or None if it has no deadline.
+        """
+        self.name: str = name
+        self.action: Callable = action
+        self.args: tuple = args
+        self.priority: int = priority
+        self.ready_at: float = time.time() if ready_at is None else ready_at
+        self.max_lateness: Union[float, None] = max_lateness
+        # Times the job has been dispatched, e.g. while checking back on another instance
+        self.attempts: int = 0
+        # Whether missing the deadline has been reported
+        self.missed: bool = False
+
+    @property
+    def deadline(self) -> float:
+        """
+        When the job must start by (as a `time.time()` timestamp).
+        :return: The deadline, or infinity if there is none.
+        """
+        return math.inf if self.max_lateness is None else self.ready_at + self.max_lateness
+
+    def run(self) -> None:
+        """
+        Runs the job.
+        :return: None.
+        """
+        self.action(*self.args)
+
+
+class JobQueue:
+    """
+    Holds postings that are due, so that when more are due than can run at once, the most important goes first.
+    Jobs are taken by priority, then earliest deadline, then the order they were due in.
+    """
+
+    def __init__(self):
+        # (sort key, job)
+        self.__heap: List[Tuple[tuple, Job]] = []
+        # Breaks ties in the order jobs were added
+        self.__counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.__heap)
+
+    def push(self, job: Job) -> None:
+        """
+        Adds a job to the queue.
+        :param job: The job.
+        :return: None.
+        """
+        heapq.heappush(self.__heap, ((-job.priority, job.deadline, job.ready_at, next(self.__counter)), job))
+
+    def pop(self) -> Union[Job, None]:
+        """
+        Takes the job that should run next.
+        :return: The job, or None if the queue is empty.
+        """
+        if not self.__heap:
+            return None
+        return heapq.heappop(self.__heap)[1]
+
+    def names(self) -> List[str]:
+        """
+        The names of the waiting jobs, in the order they will run.
+        :return: The names.
+        """
+        return [job.name for _, job in sorted(self.__heap)]
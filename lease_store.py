@@ -0,0 +1,376 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Set, Tuple, Union
+
+
+class LeaseLostError(Exception):
+    """
+    Raised to stop work on a name after another instance took over its lease.
+    """
+
+
+class LeaseStore:
+    """
+    Coordinates several instances of the bot through an SQLite database on a shared volume.
+    An instance must hold the lease on a name (e.g. a post slot) to act on it. Leases expire after `ttl` seconds
+    unless renewed, so if the holder dies, another instance takes over shortly after.
+    Expiry uses wall clock time, so instances on different machines need synchronized clocks.
+    The positions of rotations are kept here too, so instances don't undo each other's progress,
+    along with the progress of each slot, so an instance taking one over only posts what's left of it.
+    """
+
+    def __init__(self, path: str, node_id: Union[str, None] = None, ttl: float = 10):
+        """
+        :param path: The path of the SQLite database, shared by all instances.
+        :param node_id: A unique name for this instance. Defaults to the host name and process id.
+        :param ttl: Seconds a lease lasts without being renewed.
+        """
+        self.path: str = path
+        self.node_id: str = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl: float = ttl
+        self.__lock = threading.Lock()
+        # Autocommit mode, so transactions are controlled explicitly
+        self.__connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self.__lock:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS completed ("
+                "name TEXT PRIMARY KEY, owner TEXT NOT NULL, completed_at REAL NOT NULL)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS deferrals ("
+                "name TEXT PRIMARY KEY, remaining INTEGER NOT NULL, retry_at REAL NOT NULL)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS rotations ("
+                "post_type TEXT PRIMARY KEY, position INTEGER NOT NULL, slot TEXT NOT NULL)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS progress ("
+                "name TEXT PRIMARY KEY, total INTEGER NOT NULL, posted INTEGER NOT NULL)"
+            )
+            # Images published for a name but not removed yet
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS published ("
+                "name TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                "PRIMARY KEY (name, path))"
+            )
+
+    def acquire(self, name: str) -> bool:
+        """
+        Takes the lease on a name if it's free, expired, or already ours.
+        :param name: The name to lease.
+        :return: True if this instance now holds the lease.
+        """
+        now = time.time()
+        with self.__lock:
+            cursor = self.__connection.cursor()
+            # Take the write lock up front so two instances can't both see the lease as free
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+                if row is not None and row[0] != self.node_id and row[1] > now:
+                    return False
+                cursor.execute(
+                    "INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                    (name, self.node_id, now + self.ttl)
+                )
+                return True
+            finally:
+                cursor.execute("COMMIT")
+
+    def renew(self, name: str) -> bool:
+        """
+        Extends a lease held by this instance.
+        :param name: The leased name.
+        :return: True if the lease is still ours.
+        """
+        with self.__lock:
+            cursor = self.__connection.execute(
+                "UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?",
+                (time.time() + self.ttl, name, self.node_id)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name: str) -> None:
+        """
+        Gives up a lease held by this instance.
+        :param name: The leased name.
+        :return: None.
+        """
+        with self.__lock:
+            self.__connection.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.node_id))
+
+    def mark_done(self, name: str) -> None:
+        """
+        Records that the work for a name is finished, so no other instance takes it over.
+        Records older than a week are cleaned up.
+        :param name: The leased name.
+        :return: None.
+        """
+        now = time.time()
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO completed (name, owner, completed_at) VALUES (?, ?, ?)",
+                (name, self.node_id, now)
+            )
+            self.__connection.execute("DELETE FROM completed WHERE completed_at < ?", (now - 7 * 86400,))
+            self.__connection.execute("DELETE FROM deferrals WHERE name = ?", (name,))
+            self.__connection.execute("DELETE FROM progress WHERE name = ?", (name,))
+            self.__connection.execute("DELETE FROM published WHERE name = ?", (name,))
+
+    def is_done(self, name: str) -> bool:
+        """
+        Whether the work for a name was finished by any instance.
+        :param name: The leased name.
+        :return: True if it's finished.
+        """
+        with self.__lock:
+            row = self.__connection.execute("SELECT 1 FROM completed WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def defer(self, name: str, remaining: int, retry_at: float) -> None:
+        """
+        Records that the rest of the work for a name was put off, so any instance can finish it later.
+        :param name: The leased name.
+        :param remaining: How many images are left to post.
+        :param retry_at: When to try again (as a `time.time()` timestamp).
+        :return: None.
+        """
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO deferrals (name, remaining, retry_at) VALUES (?, ?, ?)",
+                (name, remaining, retry_at)
+            )
+
+    def deferral(self, name: str) -> Union[Tuple[int, float], None]:
+        """
+        The work put off for a name, if any.
+        :param name: The leased name.
+        :return: How many images are left to post and when to try again, or None if nothing was put off.
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT remaining, retry_at FROM deferrals WHERE name = ?", (name,)
+            ).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def start(self, name: str, total: int) -> int:
+        """
+        Starts recording the progress of the work for a name, unless an instance already started it.
+        :param name: The leased name.
+        :param total: How many images the work is, used if it wasn't started yet.
+        :return: How many images are left to post.
+        """
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR IGNORE INTO progress (name, total, posted) VALUES (?, ?, 0)", (name, total)
+            )
+            row = self.__connection.execute(
+                "SELECT total - posted FROM progress WHERE name = ?", (name,)
+            ).fetchone()
+        return max(row[0], 0)
+
+    def record_published(self, name: str, key: Tuple[str, int, int]) -> None:
+        """
+        Records that an image was published for a name, before it is removed.
+        :param name: The leased name.
+        :param key: The path, size and modification time of the image.
+        :return: None.
+        """
+        with self.__lock:
+            cursor = self.__connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("UPDATE progress SET posted = posted + 1 WHERE name = ?", (name,))
+                cursor.execute(
+                    "INSERT OR REPLACE INTO published (name, path, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                    (name, *key)
+                )
+            finally:
+                cursor.execute("COMMIT")
+
+    def record_removed(self, name: str, path: str) -> None:
+        """
+        Records that a published image was removed.
+        :param name: The leased name.
+        :param path: The path of the image.
+        :return: None.
+        """
+        with self.__lock:
+            self.__connection.execute("DELETE FROM published WHERE name = ? AND path = ?", (name, path))
+
+    def published(self, name: str) -> Set[Tuple[str, int, int]]:
+        """
+        The images published for a name that weren't removed yet, e.g. because the instance posting them died.
+        :param name: The leased name.
+        :return: The path, size and modification time of each image.
+        """
+        with self.__lock:
+            rows = self.__connection.execute(
+                "SELECT path, size, mtime_ns FROM published WHERE name = ?", (name,)
+            ).fetchall()
+        return set(rows)
+
+    def advance_rotation(self, post_type: str, slot: str, position: int, length: int) -> int:
+        """
+        Moves a rotation on to its next directory for a slot.
+        Each slot moves it on only once, so an instance taking over a slot posts from the same directory.
+        :param post_type: The name of the rotation.
+        :param slot: The slot being posted.
+        :param position: The position in the config, used if no instance has moved the rotation on yet.
+        :param length: The number of directories in the rotation.
+        :return: The position to post from.
+        """
+        with self.__lock:
+            cursor = self.__connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute(
+                    "SELECT position, slot FROM rotations WHERE post_type = ?", (post_type,)
+                ).fetchone()
+                if row is not None and row[1] == slot:
+                    return row[0] % length
+                position = ((row[0] if row is not None else position) + 1) % length
+                cursor.execute(
+                    "INSERT OR REPLACE INTO rotations (post_type, position, slot) VALUES (?, ?, ?)",
+                    (post_type, position, slot)
+                )
+                return position
+            finally:
+                cursor.execute("COMMIT")
+
+    def rotation_positions(self) -> Dict[str, int]:
+        """
+        The current position of every rotation that has been moved on.
+        :return: The position of each rotation, by name.
+        """
+        with self.__lock:
+            rows = self.__connection.execute("SELECT post_type, position FROM rotations").fetchall()
+        return dict(rows)
+
+    @contextmanager
+    def hold(self, name: str) -> Iterator[threading.Event]:
+        """
+        Holds an acquired lease for the duration of a block, renewing it in the background.
+        :param name: The leased name. Acquire it first.
+        :return: A context manager around the block, giving an event that is set if the lease is lost.
+        """
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.ttl / 3):
+                if not self.renew(name):
+                    print(f"Lost the lease on {name} to another instance")
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+            self.release(name)
+
+    @contextmanager
+    def wait_and_hold(self, name: str) -> Iterator[threading.Event]:
+        """
+        Waits for the lease on a name, then holds it for the duration of a block.
+        :param name: The name to lease.
+        :return: A context manager around the block, giving an event that is set if the lease is lost.
+        """
+        while not self.acquire(name):
+            time.sleep(self.ttl / 3)
+        with self.hold(name) as lost:
+            yield lost
+
+
+class SlotProgress:
+    """
+    The progress of a slot, kept in the lease store so an instance taking the slot over can pick up where it was left.
+    Has the same interface as a drain checkpoint: images are recorded once published and forgotten once removed,
+    so one published by an instance that died before removing it isn't published again.
+    Entries are keyed by path, size and modification time, so a new image that reuses the name isn't mistaken for one.
+    """
+
+    def __init__(self, store: LeaseStore, name: str, total: int):
+        """
+        Picks up the progress of a slot, or starts it.
+        :param store: The lease store.
+        :param name: The slot. Hold its lease.
+        :param total: How many images the slot is, used if no instance started it yet.
+        """
+        self.store: LeaseStore = store
+        self.name: str = name
+        # Images left to post when the slot was picked up
+        self.remaining: int = store.start(name, total)
+        # (path, size, modification time) of images that were published but not removed yet
+        self.published: Set[Tuple[str, int, int]] = store.published(name)
+
+    @staticmethod
+    def _key(file: os.DirEntry) -> Union[Tuple[str, int, int], None]:
+        """
+        Identifies an image by its path, size and modification time.
+        :param file: The image.
+        :return: The key, or None if the image is gone.
+        """
+        try:
+            stat = os.stat(file.path)
+        except OSError:
+            return None
+        return file.path, stat.st_size, stat.st_mtime_ns
+
+    def was_published(self, file: os.DirEntry) -> bool:
+        """
+        Whether an image was published for the slot by an instance that didn't get to remove it.
+        :param file: The image.
+        :return: True if it was published.
+        """
+        return self._key(file) in self.published
+
+    def record(self, file: os.DirEntry) -> None:
+        """
+        Records that an image was published.
+        :param file: The published image.
+        :return: None.
+        """
+        key = self._key(file)
+        if key is not None:
+            self.store.record_published(self.name, key)
+
+    def forget(self, file: os.DirEntry) -> None:
+        """
+        Forgets a published image once it's removed.
+        :param file: The removed image.
+        :return: None.
+        """
+        self.store.record_removed(self.name, file.path)
+
+
+if __name__ == '__main__':
+    # Manual check of the coordination: run this in several terminals against the same database.
+    # Exactly one holds the lease at a time, and another takes over within `ttl` seconds of it being killed.
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hold a lease until killed.")
+    parser.add_argument("path", help="The SQLite database shared by all instances.")
+    parser.add_argument("name", nargs="?", default="test", help="The name to lease.")
+    parser.add_argument("--ttl", type=float, default=10, help="Seconds a lease lasts without being renewed.")
+    args = parser.parse_args()
+
+    store = LeaseStore(args.path, ttl=args.ttl)
+    print(f"{store.node_id} waiting for {args.name}")
+    with store.wait_and_hold(args.name):
+        print(f"{store.node_id} holds {args.name}")
+        while True:
+            time.sleep(1)
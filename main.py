@@ -1,45 +1,150 @@
 from datetime import datetime, timedelta
+import argparse
 import json
 import os
+import random
 import re
 import sched
+import threading
 import time
-from typing import List, Union
-
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from concurrency import AIMDLimiter
+from config_manager import (
+    CREDENTIAL_KEYS,
+    ConfigWatcher,
+    diff_post_config,
+    load_config,
+    needs_reschedule,
+    parse_bool,
+    parse_window,
+)
 from da_token_manager import DATokenManager
 from da_poster import Poster, OAuthError
+from dns_cache import DNSCache
+from drain import DrainCheckpoint
+from job_queue import Job, JobQueue
+from lease_store import LeaseLostError, LeaseStore, SlotProgress
+from preflight import PreflightValidator
+from profiling import profiled, profiler
 
 
 # Global stuff
 TOKEN: str = ""
 DEBUG: bool = True
 DEBUG_NO_POST: bool = True
+# How often to check the config file for changes, in seconds
+CONFIG_POLL_INTERVAL: int = 30
+# How long before a post to resolve DNS and open a connection, in seconds
+WARM_UP_LEAD: int = 30
+# How many times to refresh a rejected token for an image before leaving it for the next post
+MAX_AUTH_ATTEMPTS: int = 3
 
 # Load config
-with open("da_config.json", "r") as json_file:
-    da_config_dict: dict = json.load(json_file)
-    for key in da_config_dict.keys():
-        if isinstance(da_config_dict[key], int):
-            da_config_dict[key] = str(da_config_dict[key])
-    DEBUG = eval(da_config_dict.get("debug", "True"))
-    DEBUG_NO_POST = eval(da_config_dict.get("debug_no_post", "True"))
-
-# Set up the token manager and poster
-token_manager = DATokenManager(da_config_dict, debug=DEBUG)
-TOKEN = token_manager.token     # keep this up to date during testing
-poster = Poster()
+da_config_dict: dict = load_config("da_config.json")
+DEBUG = parse_bool(da_config_dict.get("debug", True), "debug")
+DEBUG_NO_POST = parse_bool(da_config_dict.get("debug_no_post", True), "debug_no_post")
+
+# Profiling is off unless turned on in the config or with the `DA_PROFILE` environment variable
+profiling_config: dict = da_config_dict.get("profiling", {})
+profiling_enabled: bool = parse_bool(profiling_config.get("enabled", False), "profiling.enabled")
+if os.environ.get("DA_PROFILE", "").strip():
+    try:
+        profiling_enabled = parse_bool(os.environ["DA_PROFILE"], "DA_PROFILE")
+    except ValueError as exc:
+        print(f"Ignoring DA_PROFILE: {exc}")
+profiler.configure(
+    profiling_enabled,
+    directory=profiling_config.get("directory", "profiles"),
+    retain=profiling_config.get("retain", 50),
+)
+
+# Set up the token manager and poster.
+# The token is refreshed when it's first needed, so scheduling doesn't wait on the network.
+token_manager = DATokenManager(da_config_dict, debug=DEBUG, refresh_on_init=False)
+# Keep resolver outages from failing uploads
+dns_cache = DNSCache([Poster.API_HOST], debug=DEBUG)
+dns_cache.install()
+# Shared by all post types, so an outage pauses everything instead of each one retrying on its own
+breaker_config: dict = da_config_dict.get("circuit_breaker", {})
+breaker = CircuitBreaker(
+    failure_threshold=breaker_config.get("failure_threshold", 3),
+    reset_timeout=breaker_config.get("reset_timeout", 300),
+)
+# Adapts how many uploads are in flight to how DeviantArt and the uplink are coping
+uploads_config: dict = da_config_dict.get("uploads", {})
+upload_limiter = AIMDLimiter(maximum=uploads_config.get("max_concurrent", 4))
+poster = Poster(dns_cache, breaker, upload_limiter)
+# Finds corrupt or oversized images before they're uploaded
+preflight_config: dict = da_config_dict.get("preflight", {})
+preflight = PreflightValidator(
+    max_file_size=int(preflight_config.get("max_file_size_mb", 30) * 2 ** 20),
+    max_dimension=preflight_config.get("max_dimension", None),
+    workers=preflight_config.get("workers", 4),
+)
 
 # Initialize the scheduler
 scheduler = sched.scheduler(time.time, time.sleep)
-
-
-def update_token() -> None:
+# Pending events (warm up and posting) of each post type
+scheduled_events: Dict[str, List[sched.Event]] = {}
+# Postings that are due, run one at a time by priority and deadline
+job_queue = JobQueue()
+# The pending event that runs the next job, if any
+dispatch_event: Union[sched.Event, None] = None
+# The job running now, if any
+current_job: Union[Job, None] = None
+# Picks up changes to the config file while running
+config_watcher = ConfigWatcher("da_config.json")
+# Keeps uploads running in parallel from refreshing the token at the same time
+token_lock = threading.Lock()
+
+# When running more than one instance, they share leases so each slot is posted exactly once
+ha_config: Union[dict, None] = da_config_dict.get("high_availability")
+lease_store: Union[LeaseStore, None] = None
+if ha_config is not None:
+    lease_store = LeaseStore(
+        ha_config["lease_path"],
+        node_id=os.environ.get("DA_NODE_ID", ha_config.get("node_id")),
+        ttl=ha_config.get("lease_ttl", 10),
+    )
+
+
+@contextmanager
+def config_file_lock() -> Iterator[None]:
+    """
+    Holds the config file for the duration of a block that refreshes the token or saves the file.
+    Other instances share the config file, so only one refreshes (and saves) at a time,
+    and a token they refreshed is picked up instead of refreshing again.
+    :return: A context manager around the block.
+    """
+    with token_lock:
+        if lease_store is None:
+            yield
+            return
+        with lease_store.wait_and_hold("token"):
+            try:
+                token_manager.update_credentials(load_config(config_watcher.path))
+            except (OSError, ValueError) as exc:
+                print(f"Unable to check for credentials from other instances: {exc}")
+            # Save the rotations as other instances left them, rather than what this one last saw
+            sync_rotations()
+            yield
+
+
+def update_token(rejected: Union[str, None] = None) -> None:
     """
     Makes sure the token is valid. Call this before performing an action on the API.
+    :param rejected: A token DeviantArt rejected, which is refreshed even if it looks unexpired.
     :return: None
     """
     global TOKEN
-    TOKEN = token_manager.token
+    with config_file_lock():
+        if rejected is not None:
+            token_manager.invalidate(rejected)
+        TOKEN = token_manager.token
 
 
 def resolve_tags(post_config: dict, post_index: int | None = None) -> List[str]:
@@ -59,12 +164,15 @@ def resolve_tags(post_config: dict, post_index: int | None = None) -> List[str]:
     return tags
 
 
+@profiled("make_post")
 def make_post(directory: str,
               num_images: int,
               galleries: List[str],
               tags: List[str],
               is_ai: Union[str, bool],
-              artist_comments_prepend: str = "") -> None:
+              artist_comments_prepend: str = "",
+              progress: Union[SlotProgress, None] = None,
+              lost: Union[threading.Event, None] = None) -> Tuple[int, float]:
     """
     Make a post to DeviantArt using the relevant parameters.
     :param directory: The directory to post from.
@@ -73,29 +181,146 @@ def make_post(directory: str,
     :param tags: The tags to use for the image(s).
     :param is_ai: Whether the image is an AI or not.
     :param artist_comments_prepend: Text to prepend to the image's artist comments.
-    :return: None.
+    :param progress: Where the slot's progress is recorded, with several instances.
+    :param lost: Set if another instance takes the slot over, to stop posting.
+    :return: The number of images put off because DeviantArt appears to be down, and when to retry them.
+    """
+    files = list_images(directory)
+    if files is None:
+        return 0, 0.0
+    if progress is not None:
+        pending = []
+        for file in files:
+            if progress.was_published(file):
+                # Published by an instance that died before removing it
+                os.remove(file.path)
+                progress.forget(file)
+            else:
+                pending.append(file)
+        files = pending
+    if num_images <= 0:
+        return 0, 0.0
+    if len(files) == 0:
+        print(f"Out of files to post in {directory}")
+        return 0, 0.0
+
+    # Extract only the number of files we're posting, skipping (and quarantining) bad ones
+    files = preflight.select(files, num_images)
+    if len(files) == 0:
+        print(f"Out of valid files to post in {directory}")
+        return 0, 0.0
+
+    if DEBUG:
+        print(f"Posting files: {files}")
+
+    update_token()
+    deferred, retry_at = post_files(files,
+                                    galleries,
+                                    tags,
+                                    is_ai,
+                                    artist_comments_prepend,
+                                    on_posted=progress.record if progress is not None else None,
+                                    on_removed=progress.forget if progress is not None else None,
+                                    lost=lost)
+    if deferred:
+        print(f"DeviantArt appears to be down. Not retrying until {datetime.fromtimestamp(retry_at)}")
+    if DEBUG:
+        print(f"Upload concurrency: {upload_limiter.metrics()}")
+    return len(deferred), retry_at
+
+
+def list_images(directory: str) -> Union[List[os.DirEntry], None]:
+    """
+    Lists the images waiting to be posted in a directory, in posting order.
+    :param directory: The directory to look in.
+    :return: The images, or None if the directory doesn't exist.
     """
     if not os.path.isdir(directory):
         print(f"{directory} is not a directory!")
-        return
+        return None
     files = [
         x for x in os.scandir(directory)
         if os.path.isfile(x.path) and re.search(r"\.jpe?g$|\.png$", x.path)
     ]
-    if len(files) == 0:
-        print(f"Out of files to post in {directory}")
-        return
-
     files.sort(key=lambda x: int(re.sub(r"\D", '', x.name)))
+    return files
 
-    # Extract only the number of files we're posting
-    files = files[:num_images]
 
-    if DEBUG:
-        print(f"Posting files: {files}")
-
-    update_token()
-    for file in files:
+def post_files(files: List[os.DirEntry],
+               galleries: List[str],
+               tags: List[str],
+               is_ai: Union[str, bool],
+               artist_comments_prepend: str,
+               on_posted: Union[Callable[[os.DirEntry], None], None] = None,
+               on_removed: Union[Callable[[os.DirEntry], None], None] = None,
+               lost: Union[threading.Event, None] = None) -> Tuple[List[os.DirEntry], float]:
+    """
+    Posts images, uploading as many at once as the limiter allows but publishing them in order.
+    :param files: The images to post, in order.
+    :param galleries: The galleries to post to.
+    :param tags: The tags to use for the images.
+    :param is_ai: Whether the images are AI or not.
+    :param artist_comments_prepend: Text to prepend to the images' artist comments.
+    :param on_posted: Called with each image once it's published, before it is removed.
+    :param on_removed: Called with each image once it's removed after being published.
+    :param lost: Set if another instance takes the slot over, to stop posting.
+    :return: The images that were put off because DeviantArt appears to be down, and when to retry them.
+    """
+    published = [threading.Event() for _ in files]
+    deferred = []
+    retry_at = 0.0
+    # Time the uploads as part of the post's profile, if it has one
+    post_file_in_section = profiler.bind(post_file)
+    with ThreadPoolExecutor(max_workers=upload_limiter.maximum) as executor:
+        futures = [
+            executor.submit(post_file_in_section,
+                            file,
+                            galleries,
+                            tags,
+                            is_ai,
+                            artist_comments_prepend,
+                            published[index - 1] if index > 0 else None,
+                            published[index],
+                            on_posted,
+                            on_removed,
+                            lost)
+            for index, file in enumerate(files)
+        ]
+        for file, future in zip(files, futures):
+            try:
+                future.result()
+            except CircuitOpenError as exc:
+                deferred.append(file)
+                retry_at = max(retry_at, exc.retry_at)
+    return deferred, retry_at
+
+
+def post_file(file: os.DirEntry,
+              galleries: List[str],
+              tags: List[str],
+              is_ai: Union[str, bool],
+              artist_comments_prepend: str,
+              previous_published: Union[threading.Event, None],
+              published: threading.Event,
+              on_posted: Union[Callable[[os.DirEntry], None], None] = None,
+              on_removed: Union[Callable[[os.DirEntry], None], None] = None,
+              lost: Union[threading.Event, None] = None) -> None:
+    """
+    Posts a single image, then removes it.
+    :param file: The image to post.
+    :param galleries: The galleries to post to.
+    :param tags: The tags to use for the image.
+    :param is_ai: Whether the image is an AI or not.
+    :param artist_comments_prepend: Text to prepend to the image's artist comments.
+    :param previous_published: Set once the previous image in the post is done, so images are published in order.
+    :param published: Set once this image is done (posted or not).
+    :param on_posted: Called with the image once it's published, before it is removed.
+    :param on_removed: Called with the image once it's removed after being published.
+    :param lost: Set if another instance takes the slot over. Checked before uploading and before publishing.
+    :return: None.
+    :raises CircuitOpenError: If DeviantArt appears to be down.
+    """
+    try:
         base_name = file.name[:file.name.rfind(".")]
         base_path = file.path[:file.path.rfind(".")]
         if os.path.isfile(base_path + ".txt"):
@@ -111,79 +336,470 @@ def make_post(directory: str,
 
         # Post the image
         if not DEBUG_NO_POST:
+            def before_publish() -> None:
+                if previous_published is not None:
+                    previous_published.wait()
+                # Checked last, since the previous image can take a while
+                if lost is not None and lost.is_set():
+                    raise LeaseLostError(f"Lost the lease before publishing {file.path}")
+
             submitted: bool = False
+            auth_attempts: int = 0
             while not submitted:
+                if lost is not None and lost.is_set():
+                    print(f"Not uploading {file.path}, as another instance took over")
+                    return
+                token = TOKEN
                 try:
                     poster.upload_and_submit(file.path,
-                                             TOKEN,
+                                             token,
                                              post_name,
                                              comment,
                                              tags,
                                              galleries,
                                              is_ai_generated=is_ai,
-                                             debug=DEBUG)
+                                             debug=DEBUG,
+                                             before_publish=before_publish)
                     submitted = True
+                except LeaseLostError as exc:
+                    print(f"{exc}. Leaving it to the instance that took over.")
+                    return
                 except OAuthError:
-                    update_token()
-            os.remove(file.path)
+                    auth_attempts += 1
+                    if auth_attempts >= MAX_AUTH_ATTEMPTS:
+                        print(f"DeviantArt keeps rejecting the token. Leaving {file.path} for the next post.")
+                        return
+                    # The saved expiry can't be trusted once DeviantArt has said otherwise
+                    update_token(rejected=token)
+                    time.sleep(auth_attempts)
+            if on_posted is not None:
+                on_posted(file)
+            try:
+                os.remove(file.path)
+            except FileNotFoundError:
+                # Already removed, e.g. by another instance
+                pass
+            if on_removed is not None:
+                on_removed(file)
+    finally:
+        published.set()
+
+
+def defer_post(retry_at: float, post_type: str, slot: str, num_images: int) -> None:
+    """
+    Puts off the rest of a slot until the API may be back up.
+    Images stay in their directory until they are posted, so the directory is the durable queue
+    and nothing is lost if the bot restarts in the meantime.
+    :param retry_at: When to try posting again (as a `time.time()` timestamp).
+    :param post_type: The name of the post type in `post_config`.
+    :param slot: The slot being posted.
+    :param num_images: The number of images left to post.
+    :return: None.
+    """
+    # The rotation already moved on for the first attempt
+    job = slot_job(post_type, slot, num_images, False, retry_at)
+    job.name = f"{slot} (deferred)"
+    scheduler.enterabs(retry_at, 1, enqueue, argument=(job,))
+    print(f"Deferred posting {num_images} image(s) of {slot} until {datetime.fromtimestamp(retry_at)}")
 
 
-def post_scheduler() -> None:
+def slot_job(post_type: str, slot: str, num_images: int, advance: bool, ready_at: float) -> Job:
     """
-    Schedules posts to happen based on the configuration file.
+    Makes the job that posts a slot, with the priority and deadline of its post type.
+    :param post_type: The name of the post type in `post_config`.
+    :param slot: Identifies the posting across instances.
+    :param num_images: The number of images to post.
+    :param advance: Whether to advance the rotation first.
+    :param ready_at: When the posting is due (as a `time.time()` timestamp).
+    :return: The job.
+    """
+    post_config = da_config_dict["post_config"].get(post_type, {})
+    return Job(slot,
+               run_slot,
+               (post_type, slot, num_images, advance),
+               priority=post_config.get("priority", 0),
+               ready_at=ready_at,
+               max_lateness=post_config.get("max_lateness"))
+
+
+def enqueue(job: Job) -> None:
+    """
+    Adds a job to the queue, making sure it will be dispatched.
+    :param job: The job.
     :return: None.
     """
-    global da_config_dict, scheduler
-    for post_type in da_config_dict["post_config"].keys():
-        post_config = da_config_dict["post_config"][post_type]
-        posting_type = post_config["type"]
-        if posting_type.lower() == "rotation":
-            # Take advantage of the fact that the token manager has a shallow copy of the dictionary
-            post_config["last_posted"] += 1
-            # token_manager.extra_config["post_config"][post_type]["last_posted"] += 1
-            if post_config["last_posted"] >= len(post_config["directories"]):
-                post_config["last_posted"] = 0
-                # token_manager.extra_config["post_config"][post_type]["last_posted"] = 0
-            token_manager.increment_rotation_config(post_type, post_config["last_posted"])
-
-            # Figure out what we're posting
-            post_index = post_config["last_posted"]
-            directory = post_config["directories"][post_index]
-            tags = resolve_tags(post_config, post_index)
-
-        elif posting_type.lower() == "daily":
-            # Figure out what we're posting
-            directory = post_config["directory"]
-            tags = resolve_tags(post_config)
+    global dispatch_event
+    job_queue.push(job)
+    # A running job dispatches the next one when it's done
+    if dispatch_event is None and current_job is None:
+        dispatch_event = scheduler.enter(0, 1, dispatch)
+
+
+def dispatch() -> None:
+    """
+    Runs the job that should go next, reporting how late it started.
+    :return: None.
+    """
+    global dispatch_event, current_job
+    dispatch_event = None
+    job = job_queue.pop()
+    if job is None:
+        return
+    now = time.time()
+    lateness = max(now - job.ready_at, 0.0)
+    job.attempts += 1
+    if now > job.deadline and not job.missed:
+        job.missed = True
+        print(f"{job.name} missed its deadline: started {lateness:.0f} s late "
+              f"(allowed {job.max_lateness:.0f} s, priority {job.priority})")
+    elif job.attempts == 1 or DEBUG:
+        # Jobs checking back on another instance are only reported the first time
+        print(f"Starting {job.name} {lateness:.0f} s late (priority {job.priority})")
+    current_job = job
+    try:
+        job.run()
+    finally:
+        current_job = None
+        if len(job_queue):
+            if DEBUG:
+                print(f"Waiting jobs: {job_queue.names()}")
+            # Entered for now, so postings that came due while this job ran are queued before picking the next one
+            dispatch_event = scheduler.enter(0, 1, dispatch)
+
+
+def run_post_type(post_type: str, slot: str, num_images: int, advance: bool, last: bool, due: float) -> None:
+    """
+    Queues one scheduled posting of a post type, scheduling the next ones after the last posting of the day.
+    :param post_type: The name of the post type in `post_config`.
+    :param slot: Identifies this posting across instances.
+    :param num_images: The number of images to post.
+    :param advance: Whether to advance the rotation first (only for the first posting of the day).
+    :param last: Whether this is the last posting of the day.
+    :param due: When the posting was scheduled for (as a `time.time()` timestamp).
+    :return: None.
+    """
+    if post_type not in da_config_dict["post_config"]:
+        return
+    if last:
+        scheduled_events.pop(post_type, None)
+        schedule_post_type(post_type)
+    enqueue(slot_job(post_type, slot, num_images, advance, due))
 
+
+def run_slot(post_type: str, slot: str, num_images: int, advance: bool) -> None:
+    """
+    Posts for a slot, unless another instance is or already did.
+    If another instance holds the slot, checks back in case it dies before finishing.
+    If DeviantArt is down, the rest of the slot is put off. With several instances, this is recorded in the
+    lease store and the slot isn't done until the rest is posted, so any instance can finish it.
+    Each image posted is recorded there too, so an instance taking the slot over only posts what's left.
+    :param post_type: The name of the post type in `post_config`.
+    :param slot: Identifies this posting across instances.
+    :param num_images: The number of images to post.
+    :param advance: Whether to advance the rotation first.
+    :return: None.
+    """
+    if lease_store is None:
+        deferred, retry_at = post_now(post_type, slot, num_images, advance)
+        if deferred:
+            defer_post(retry_at, post_type, slot, deferred)
+        return
+    if lease_store.is_done(slot):
+        print(f"{slot} was posted by another instance")
+        return
+    if not lease_store.acquire(slot):
+        # Check back through the queue, keeping the original due time so lateness is still measured from it
+        job = current_job if current_job is not None else slot_job(post_type, slot, num_images, advance, time.time())
+        scheduler.enter(lease_store.ttl / 3, 1, enqueue, argument=(job,))
+        return
+    with lease_store.hold(slot) as lost:
+        deferral = lease_store.deferral(slot)
+        if deferral is not None:
+            remaining, retry_at = deferral
+            if retry_at > time.time():
+                # Put off by an instance that let go of the slot, e.g. by dying
+                defer_post(retry_at, post_type, slot, remaining)
+                return
+            # The rotation already moved on for the first attempt
+            advance = False
+        # Picks up what an instance that let go of the slot already posted
+        progress = SlotProgress(lease_store, slot, num_images)
+        deferred, retry_at = post_now(post_type, slot, progress.remaining, advance, progress, lost)
+        if lost.is_set():
+            # The instance that took over finishes the slot from the recorded progress
+            return
+        if deferred:
+            lease_store.defer(slot, deferred, retry_at)
+            defer_post(retry_at, post_type, slot, deferred)
         else:
-            print(f"Invalid configuration for posting type: {posting_type}")
-            exit(1)
+            lease_store.mark_done(slot)
 
-        # Grab common config arguments
-        images_per_day: int = post_config["images_per_day"]
-        time_of_day: str = post_config["time"]
-        galleries: List[str] = post_config["galleries"]
-        is_ai: Union[str, bool] = post_config.get("is_ai", False)
-        artist_comments_prepend: str = post_config.get("artist_comments_prepend", "")
 
-        # Figure out when to schedule the posting
-        hour, minute = tuple(time_of_day.split(":"))
-        hour, minute = int(hour), int(minute)
-        now = datetime.now()
-        target_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+def post_now(post_type: str,
+             slot: str,
+             num_images: Union[int, None] = None,
+             advance: bool = True,
+             progress: Union[SlotProgress, None] = None,
+             lost: Union[threading.Event, None] = None) -> Tuple[int, float]:
+    """
+    Posts images for a post type using its current configuration.
+    :param post_type: The name of the post type in `post_config`.
+    :param slot: Identifies this posting, e.g. in profile names.
+    :param num_images: The number of images to post. Defaults to `images_per_day`.
+    :param advance: Whether to advance the rotation to the next directory first.
+    :param progress: Where the slot's progress is recorded, with several instances.
+    :param lost: Set if another instance takes the slot over, to stop posting.
+    :return: The number of images put off because DeviantArt appears to be down, and when to retry them.
+    """
+    # Posting saves the config file, so pick up edits to it first (and progress saved by other instances)
+    reload_config()
+    post_config = da_config_dict["post_config"].get(post_type)
+    if post_config is None:
+        return 0, 0.0
+
+    posting_type = post_config["type"]
+    if posting_type.lower() == "rotation":
+        if advance:
+            advance_rotation(post_type, slot)
+
+        # Figure out what we're posting
+        post_index = post_config["last_posted"]
+        directory = post_config["directories"][post_index]
+        tags = resolve_tags(post_config, post_index)
+
+    elif posting_type.lower() == "daily":
+        # Figure out what we're posting
+        directory = post_config["directory"]
+        tags = resolve_tags(post_config)
+
+    else:
+        print(f"Invalid configuration for posting type: {posting_type}")
+        exit(1)
+
+    # Grab common config arguments
+    if num_images is None:
+        num_images = post_config["images_per_day"]
+    galleries: List[str] = post_config["galleries"]
+    is_ai: Union[str, bool] = post_config.get("is_ai", False)
+    artist_comments_prepend: str = post_config.get("artist_comments_prepend", "")
+
+    # Profiled under the slot, so each posting gets its own artifacts
+    with profiler.section(slot):
+        return make_post(directory, num_images, galleries, tags, is_ai, artist_comments_prepend, progress, lost)
+
+
+def advance_rotation(post_type: str, slot: str) -> None:
+    """
+    Moves a rotation on to its next directory.
+    :param post_type: The name of the rotation in `post_config`.
+    :param slot: The slot being posted.
+    :return: None.
+    """
+    post_config = da_config_dict["post_config"][post_type]
+    length = len(post_config["directories"])
+    if lease_store is None:
+        position = (post_config["last_posted"] + 1) % length
+    else:
+        # Shared by all instances and recorded against the slot, so taking over a slot doesn't move it on again
+        position = lease_store.advance_rotation(post_type, slot, post_config["last_posted"], length)
+    # Take advantage of the fact that the token manager has a shallow copy of the dictionary
+    post_config["last_posted"] = position
+    token_manager.increment_rotation_config(post_type, position)
+    # Save now, so a later reload of an edited file can't take the rotation back
+    with config_file_lock():
+        token_manager.save_config()
+
+
+def sync_rotations() -> None:
+    """
+    Adopts the rotation positions shared by all instances through the lease store.
+    :return: None.
+    """
+    if lease_store is None:
+        return
+    for post_type, position in lease_store.rotation_positions().items():
+        post_config = da_config_dict["post_config"].get(post_type)
+        if post_config is not None and post_config["type"].lower() == "rotation":
+            post_config["last_posted"] = position % len(post_config["directories"])
+
 
+def next_postings(post_type: str, now: datetime) -> List[Tuple[datetime, int, bool]]:
+    """
+    Works out the upcoming postings of a post type.
+    Without a posting window, all of `images_per_day` are posted at `time`. With one, they are posted one at a time,
+    evenly spaced across the window or at a random point within each even share of it.
+    :param post_type: The name of the post type in `post_config`.
+    :param now: The current time.
+    :return: The (time, number of images, whether to advance the rotation) of each posting, in order.
+    """
+    post_config = da_config_dict["post_config"][post_type]
+    images_per_day: int = post_config["images_per_day"]
+    if "window" not in post_config:
+        hour, minute = tuple(post_config["time"].split(":"))
+        target_time = now.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
         # If the target time is already past today, schedule for tomorrow
         if target_time <= now:
             target_time += timedelta(days=1)
+        return [(target_time, images_per_day, True)]
+
+    (start_hour, start_minute), (end_hour, end_minute) = parse_window(post_config["window"])
+    # Start from yesterday's window, which is still open in the early hours if it runs past midnight
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    while True:
+        start = day.replace(hour=start_hour, minute=start_minute)
+        end = day.replace(hour=end_hour, minute=end_minute)
+        if end <= start:
+            end += timedelta(days=1)
+        share = (end - start) / images_per_day
+        # Seeded by the day so every instance, and every reschedule, picks the same times
+        jitter = random.Random(f"{post_type}@{start.date().isoformat()}")
+        postings = []
+        for index in range(images_per_day):
+            offset = jitter.random() if post_config.get("spacing", "even") == "jitter" else 0.0
+            posting_time = (start + share * (index + offset)).replace(microsecond=0)
+            if posting_time > now:
+                # Only the first posting of the window moves the rotation on
+                postings.append((posting_time, 1, index == 0))
+        if postings:
+            return postings
+        day += timedelta(days=1)
+
+
+def schedule_post_type(post_type: str) -> None:
+    """
+    Schedules the next postings of a post type based on the configuration file.
+    :param post_type: The name of the post type in `post_config`.
+    :return: None.
+    """
+    now = datetime.now()
+    postings = next_postings(post_type, now)
+    events = []
+    for index, (target_time, num_images, advance) in enumerate(postings):
         delay = (target_time - now).total_seconds()
-        scheduler.enter(
+        if delay > WARM_UP_LEAD:
+            events.append(scheduler.enter(delay - WARM_UP_LEAD, 1, warm_up,
+                                          argument=(post_type, num_images, advance)))
+        events.append(scheduler.enter(
             delay,
             1,
-            make_post,
-            argument=(directory, images_per_day, galleries, tags, is_ai, artist_comments_prepend)
-        )
-        print(f"Scheduled posting of {post_type} for {target_time}")
+            run_post_type,
+            argument=(post_type,
+                      f"{post_type}@{target_time.isoformat(timespec='seconds')}",
+                      num_images,
+                      advance,
+                      index == len(postings) - 1,
+                      target_time.timestamp())
+        ))
+    scheduled_events[post_type] = events
+    if len(postings) == 1:
+        print(f"Scheduled posting of {post_type} for {postings[0][0]}")
+    else:
+        print(f"Scheduled {len(postings)} postings of {post_type} from {postings[0][0]} to {postings[-1][0]}")
+
+
+def warm_up(post_type: str, num_images: int, advance: bool) -> None:
+    """
+    Gets ready for the next posting of a post type: opens a connection and checks the images it will post.
+    :param post_type: The name of the post type in `post_config`.
+    :param num_images: The number of images the posting will post.
+    :param advance: Whether the posting will advance the rotation first.
+    :return: None.
+    """
+    poster.warm_up()
+    post_config = da_config_dict["post_config"].get(post_type)
+    if post_config is None:
+        return
+    if post_config["type"].lower() == "rotation":
+        post_index = (post_config["last_posted"] + advance) % len(post_config["directories"])
+        directory = post_config["directories"][post_index]
+    else:
+        directory = post_config["directory"]
+    files = list_images(directory)
+    if files:
+        preflight.select(files, num_images)
+
+
+def unschedule_post_type(post_type: str) -> None:
+    """
+    Removes the pending posting of a post type, if there is one.
+    Posts that are already running are not affected.
+    :param post_type: The name of the post type in `post_config`.
+    :return: None.
+    """
+    for event in scheduled_events.pop(post_type, []):
+        if event in scheduler.queue:
+            scheduler.cancel(event)
+
+
+def post_scheduler() -> None:
+    """
+    Schedules posts to happen based on the configuration file.
+    :return: None.
+    """
+    for post_type in da_config_dict["post_config"].keys():
+        schedule_post_type(post_type)
+
+
+def apply_config(new_config: dict) -> None:
+    """
+    Applies a reloaded configuration, only touching the post types that changed.
+    :param new_config: The new, validated configuration.
+    :return: None.
+    """
+    post_config = da_config_dict["post_config"]
+    new_post_config = new_config["post_config"]
+    added, removed, changed = diff_post_config(post_config, new_post_config)
+
+    for post_type in removed:
+        unschedule_post_type(post_type)
+        del post_config[post_type]
+        print(f"Removed posting of {post_type}")
+    for post_type in changed:
+        old_entry = post_config[post_type]
+        # Update in place, since the token manager shares this dictionary
+        post_config[post_type] = new_post_config[post_type]
+        if needs_reschedule(old_entry, new_post_config[post_type]):
+            unschedule_post_type(post_type)
+            schedule_post_type(post_type)
+        else:
+            print(f"Updated configuration of {post_type}")
+    for post_type in added:
+        post_config[post_type] = new_post_config[post_type]
+        schedule_post_type(post_type)
+
+    # Everything else only takes effect on restart, but keep it so the token manager doesn't overwrite it
+    for key, value in new_config.items():
+        if key in CREDENTIAL_KEYS or key == "post_config":
+            continue
+        if token_manager.extra_config.get(key) != value:
+            token_manager.extra_config[key] = value
+            print(f"Configuration of {key} changed. Restart to apply it.")
+    token_manager.update_credentials(new_config)
+
+
+def reload_config() -> None:
+    """
+    Reloads the configuration file if it changed.
+    :return: None.
+    """
+    try:
+        new_config = config_watcher.poll()
+    except (OSError, ValueError) as exc:
+        print(f"Ignoring invalid configuration change: {exc}")
+        new_config = None
+    if new_config is not None:
+        apply_config(new_config)
+    # The file may be behind the rotations, so the lease store has the final say
+    sync_rotations()
+
+
+def check_config() -> None:
+    """
+    Reloads the configuration file if it changed, then checks again later.
+    :return: None.
+    """
+    reload_config()
+    scheduler.enter(CONFIG_POLL_INTERVAL, 2, check_config)
 
 
 def run_scheduler() -> None:
@@ -191,20 +807,121 @@ def run_scheduler() -> None:
     The main post scheduling loop.
     :return: None.
     """
-    while True:
-        # Schedule the task
-        post_scheduler()
+    # Schedule the tasks. Each one schedules its next posting when it runs.
+    post_scheduler()
+    scheduler.enter(CONFIG_POLL_INTERVAL, 2, check_config)
+
+    # Run the scheduler
+    scheduler.run()
+
+
+def drain(post_type: str,
+          directory: Union[str, None] = None,
+          limit: Union[int, None] = None,
+          checkpoint_path: str = "drain_checkpoint.json") -> None:
+    """
+    Posts everything waiting in a post type's directories as fast as DeviantArt allows, ignoring its schedule.
+    Progress is checkpointed, so the drain can be interrupted (Ctrl+C) and resumed by running it again.
+    :param post_type: The name of the post type in `post_config`.
+    :param directory: Only drain this one of the post type's directories.
+    :param limit: The most images to post in this run.
+    :param checkpoint_path: Where to save progress.
+    :return: None.
+    """
+    post_config = da_config_dict["post_config"].get(post_type)
+    if post_config is None:
+        print(f"No post type named {post_type}")
+        exit(1)
+    if post_config["type"].lower() == "rotation":
+        targets = [
+            (path, resolve_tags(post_config, index))
+            for index, path in enumerate(post_config["directories"])
+        ]
+    else:
+        targets = [(post_config["directory"], resolve_tags(post_config))]
+    if directory is not None:
+        targets = [target for target in targets if os.path.abspath(target[0]) == os.path.abspath(directory)]
+        if not targets:
+            print(f"{directory} is not one of the directories of {post_type}")
+            exit(1)
 
-        # Run the scheduler
-        scheduler.run()
+    galleries: List[str] = post_config["galleries"]
+    is_ai: Union[str, bool] = post_config.get("is_ai", False)
+    artist_comments_prepend: str = post_config.get("artist_comments_prepend", "")
+    # Enough to keep the limiter busy while still stopping soon after an interrupt
+    batch_size = upload_limiter.maximum * 2
+    checkpoint = DrainCheckpoint(checkpoint_path, post_type)
+    remaining = limit
 
-        # Wait for one hour before checking again
-        time.sleep(3600)
+    update_token()
+    try:
+        for target_directory, tags in targets:
+            files = list_images(target_directory)
+            if files is None:
+                continue
+            pending = []
+            for file in files:
+                if checkpoint.was_published(file):
+                    # Published, but interrupted before it was removed
+                    os.remove(file.path)
+                    checkpoint.forget(file)
+                else:
+                    pending.append(file)
+
+            while pending:
+                size = batch_size if remaining is None else min(batch_size, remaining)
+                if size <= 0:
+                    break
+                # Validate a batch at a time, so a large backlog starts posting without reading every image first
+                batch, pending = preflight.select(pending[:size]), pending[size:]
+                if not batch:
+                    continue
+                deferred, retry_at = post_files(batch,
+                                                galleries,
+                                                tags,
+                                                is_ai,
+                                                artist_comments_prepend,
+                                                on_posted=checkpoint.record,
+                                                on_removed=checkpoint.forget)
+                if remaining is not None:
+                    remaining -= len(batch) - len(deferred)
+                checkpoint.report(upload_limiter.limit)
+                if deferred:
+                    print(f"DeviantArt appears to be down. Waiting until {datetime.fromtimestamp(retry_at)}")
+                    time.sleep(max(retry_at - time.time(), 0))
+                    pending = deferred + pending
+            if remaining is not None and remaining <= 0:
+                checkpoint.save()
+                print(f"Posted {limit} image(s). Run the drain again to continue.")
+                return
+    except KeyboardInterrupt:
+        checkpoint.save()
+        print(f"Drain interrupted. Run it again to resume from {checkpoint_path}")
+        return
+    checkpoint.remove()
+    print(f"Finished draining {post_type}")
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Post images to DeviantArt on a schedule.")
+    subparsers = parser.add_subparsers(dest="command")
+    drain_parser = subparsers.add_parser(
+        "drain",
+        help="Post everything waiting for a post type as fast as DeviantArt allows, then exit."
+    )
+    drain_parser.add_argument("post_type", help="The post type in `post_config` to drain.")
+    drain_parser.add_argument("--directory", help="Only drain this one of the post type's directories.")
+    drain_parser.add_argument("--limit", type=int, help="The most images to post.")
+    drain_parser.add_argument("--checkpoint", default="drain_checkpoint.json",
+                              help="Where to save progress for resuming.")
+    args = parser.parse_args()
+
     # Print config information
-    print(f"{DEBUG=}\n{DEBUG_NO_POST=}")
+    print(f"{DEBUG=}\n{DEBUG_NO_POST=}\nprofiling={profiler.enabled}")
+    if args.command == "drain":
+        drain(args.post_type, args.directory, args.limit, args.checkpoint)
+        exit(0)
+
     print("Config\n", "-" * 20, "\n")
     for post_type in da_config_dict["post_config"].keys():
         print(json.dumps(da_config_dict["post_config"][post_type], indent=4))
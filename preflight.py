@@ -0,0 +1,302 @@
+import os
+import re
+import shutil
+import struct
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+# JPEG start of frame markers, which hold the dimensions (0xC4, 0xC8 and 0xCC are other segments)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without a length
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+# Seconds since an image was last modified before it's checked, as it may still be being copied in
+SETTLE_TIME = 5
+# Problems that may clear up on their own, so the image is skipped for now rather than quarantined
+MISSING = "the file is missing"
+UNREADABLE = "the file could not be read"
+UNSETTLED = "the file was modified too recently"
+TRANSIENT_PROBLEMS = {MISSING, UNREADABLE, UNSETTLED}
+
+
+def _png_dimensions(image_file) -> Tuple[int, int]:
+    """
+    Reads the dimensions of a PNG from its IHDR chunk.
+    :param image_file: The image, opened in binary mode.
+    :return: (width, height).
+    :raises ValueError: If the header is invalid.
+    """
+    image_file.seek(8)
+    header = image_file.read(16)
+    if len(header) < 16 or header[4:8] != b"IHDR":
+        raise ValueError("missing PNG header")
+    return struct.unpack(">II", header[8:16])
+
+
+def _jpeg_dimensions(image_file) -> Tuple[int, int]:
+    """
+    Reads the dimensions of a JPEG from its start of frame segment.
+    :param image_file: The image, opened in binary mode.
+    :return: (width, height).
+    :raises ValueError: If no valid start of frame is found.
+    """
+    image_file.seek(2)
+    while True:
+        byte = image_file.read(1)
+        if not byte:
+            raise ValueError("no JPEG frame found")
+        if byte != b"\xff":
+            continue
+        marker = image_file.read(1)
+        # Skip fill bytes
+        while marker == b"\xff":
+            marker = image_file.read(1)
+        if not marker:
+            raise ValueError("no JPEG frame found")
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        if marker == 0xD9:
+            raise ValueError("no JPEG frame found")
+        length_bytes = image_file.read(2)
+        if len(length_bytes) < 2:
+            raise ValueError("truncated JPEG segment")
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            frame = image_file.read(5)
+            if len(frame) < 5:
+                raise ValueError("truncated JPEG frame")
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+        image_file.seek(length - 2, os.SEEK_CUR)
+
+
+def _png_complete(image_file) -> bool:
+    """
+    Walks the chunks of a PNG to check that it reaches its end. Data after the end is allowed.
+    :param image_file: The image, opened in binary mode.
+    :return: True if the IEND chunk is there.
+    """
+    image_file.seek(8)
+    while True:
+        header = image_file.read(8)
+        if len(header) < 8:
+            return False
+        length = struct.unpack(">I", header[:4])[0]
+        if header[4:8] == b"IEND":
+            return True
+        # Skip the data and the CRC
+        image_file.seek(length + 4, os.SEEK_CUR)
+
+
+def _jpeg_complete(image_file) -> bool:
+    """
+    Walks the segments of a JPEG to its image data, then checks that the data reaches the end of image marker.
+    Data after the end (e.g. a motion photo) is allowed.
+    :param image_file: The image, opened in binary mode.
+    :return: True if the end of image marker is there.
+    """
+    image_file.seek(2)
+    while True:
+        byte = image_file.read(1)
+        if not byte:
+            return False
+        if byte != b"\xff":
+            continue
+        marker = image_file.read(1)
+        while marker == b"\xff":
+            marker = image_file.read(1)
+        if not marker:
+            return False
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        if marker == 0xD9:
+            return True
+        length_bytes = image_file.read(2)
+        if len(length_bytes) < 2:
+            return False
+        image_file.seek(struct.unpack(">H", length_bytes)[0] - 2, os.SEEK_CUR)
+        if marker == 0xDA:
+            break
+    # Markers can't appear inside image data, so the first end of image marker after the scan header is the end.
+    # Metadata before the scan (e.g. EXIF thumbnails) has been skipped, so its markers aren't mistaken for it.
+    previous = b""
+    while True:
+        chunk = image_file.read(2 ** 16)
+        if not chunk:
+            return False
+        if b"\xff\xd9" in previous[-1:] + chunk:
+            return True
+        previous = chunk
+
+
+def inspect_image(path: str, max_file_size: int, max_dimension: Union[int, None]) -> Union[str, None]:
+    """
+    Checks that an image looks uploadable, without decoding the whole image.
+    :param path: The path of the image.
+    :param max_file_size: The largest file size allowed, in bytes.
+    :param max_dimension: The largest width or height allowed, in pixels, or None for no limit.
+    :return: Why the image is bad, or None if it's good.
+    :raises OSError: If the image can't be read, which says nothing about its contents.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return "the file is empty"
+    if size > max_file_size:
+        return f"the file is too large ({size / 2 ** 20:.1f} MiB)"
+    with open(path, "rb") as image_file:
+        try:
+            signature = image_file.read(8)
+            if re.search(r"\.png$", path):
+                if signature != PNG_SIGNATURE:
+                    return "the file is not a PNG"
+                width, height = _png_dimensions(image_file)
+                complete = _png_complete(image_file)
+            elif re.search(r"\.jpe?g$", path):
+                if not signature.startswith(JPEG_SIGNATURE):
+                    return "the file is not a JPEG"
+                width, height = _jpeg_dimensions(image_file)
+                complete = _jpeg_complete(image_file)
+            else:
+                return "unsupported file type"
+            if not complete:
+                return "the file is truncated"
+        except (ValueError, struct.error) as exc:
+            return f"unable to read the image ({exc})"
+    if width == 0 or height == 0:
+        return "the image has no pixels"
+    if max_dimension is not None and max(width, height) > max_dimension:
+        return f"the image is too large ({width}x{height})"
+    return None
+
+
+class PreflightValidator:
+    """
+    Checks images before they are uploaded, so bad files are found without shipping them to DeviantArt.
+    Images are checked in parallel on a thread pool (the checks mostly wait on reading headers) and results are
+    cached by (path, size, modification time).
+    Bad images are moved to a `quarantine` directory next to them, along with their comment files.
+    """
+
+    def __init__(self,
+                 max_file_size: int = 30 * 2 ** 20,
+                 max_dimension: Union[int, None] = None,
+                 workers: int = 4,
+                 cache_size: int = 10000):
+        """
+        :param max_file_size: The largest file size allowed, in bytes.
+        :param max_dimension: The largest width or height allowed, in pixels, or None for no limit.
+        :param workers: The number of worker threads.
+        :param cache_size: The most results to cache.
+        """
+        self.max_file_size: int = max_file_size
+        self.max_dimension: Union[int, None] = max_dimension
+        self.workers: int = workers
+        self.cache_size: int = cache_size
+        # (path, size, mtime) -> why the image is bad, or None
+        self.__cache: OrderedDict = OrderedDict()
+        self.__executor: Union[ThreadPoolExecutor, None] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Starts the worker pool when it is first needed.
+        :return: The pool.
+        """
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.__executor
+
+    def check(self, files: List[os.DirEntry]) -> List[Union[str, None]]:
+        """
+        Checks images, using cached results where the file hasn't changed.
+        Images that were just modified or couldn't be read aren't checked or cached, so they're checked again later.
+        :param files: The images to check.
+        :return: Why each image is bad, or None for the good ones.
+        """
+        keys = []
+        problems: List[Union[str, None]] = []
+        settled_before = time.time_ns() - SETTLE_TIME * 10 ** 9
+        for file in files:
+            try:
+                stat = os.stat(file.path)
+            except OSError:
+                keys.append(None)
+                problems.append(MISSING)
+                continue
+            if stat.st_mtime_ns > settled_before:
+                keys.append(None)
+                problems.append(UNSETTLED)
+                continue
+            keys.append((file.path, stat.st_size, stat.st_mtime_ns))
+            problems.append(None)
+        to_check = [key for key in keys if key is not None and key not in self.__cache]
+        if to_check:
+            executor = self._get_executor()
+            futures = [executor.submit(inspect_image, key[0], self.max_file_size, self.max_dimension)
+                       for key in to_check]
+            for key, future in zip(to_check, futures):
+                try:
+                    self.__cache[key] = future.result()
+                except OSError as exc:
+                    print(f"Unable to read {key[0]}, skipping it for now: {exc}")
+            while len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+        return [self.__cache.get(key, UNREADABLE) if key is not None else problem
+                for key, problem in zip(keys, problems)]
+
+    def select(self, files: List[os.DirEntry], count: Union[int, None] = None) -> List[os.DirEntry]:
+        """
+        Picks the first good images in order, quarantining the bad ones found along the way.
+        Images that can't be checked right now (e.g. they're still being copied in) are skipped and left in place.
+        :param files: The candidate images, in posting order.
+        :param count: How many good images are wanted, or None for all of them.
+        :return: The good images.
+        """
+        selected = []
+        index = 0
+        while index < len(files) and (count is None or len(selected) < count):
+            # Check a few more than needed, in case some are bad
+            batch_size = len(files) if count is None else max(2 * (count - len(selected)), self.workers)
+            batch = files[index:index + batch_size]
+            index += len(batch)
+            for file, problem in zip(batch, self.check(batch)):
+                if problem is None:
+                    if count is None or len(selected) < count:
+                        selected.append(file)
+                elif problem not in TRANSIENT_PROBLEMS:
+                    self.quarantine(file, problem)
+        return selected
+
+    @staticmethod
+    def quarantine(file: os.DirEntry, problem: str) -> None:
+        """
+        Moves a bad image (and its comment file) out of the way.
+        :param file: The bad image.
+        :param problem: Why it's bad.
+        :return: None.
+        """
+        quarantine_directory = os.path.join(os.path.dirname(file.path), "quarantine")
+        os.makedirs(quarantine_directory, exist_ok=True)
+        base_path = file.path[:file.path.rfind(".")]
+        try:
+            shutil.move(file.path, os.path.join(quarantine_directory, file.name))
+            if os.path.isfile(base_path + ".txt"):
+                shutil.move(base_path + ".txt", os.path.join(quarantine_directory, os.path.basename(base_path) + ".txt"))
+        except OSError as exc:
+            print(f"Unable to quarantine {file.path} ({problem}): {exc}")
+            return
+        print(f"Quarantined {file.path}: {problem}")
+
+    def shutdown(self) -> None:
+        """
+        Stops the worker pool.
+        :return: None.
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
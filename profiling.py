@@ -0,0 +1,253 @@
+import functools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Iterator, List, Tuple, Union
+
+
+class Profiler:
+    """
+    Opt-in CPU and memory profiling of sections of the bot.
+    The outermost profiled section in a thread writes a `.prof` file (CPU profile, readable with `pstats`)
+    and a `.txt` summary with the peak traced memory and the timing of nested sections.
+    Only one CPU profile can run at a time, so outermost sections that overlap another are only timed.
+    Work handed to other threads is timed under the section that handed it off if wrapped with `bind`.
+    Only the newest `retain` artifacts are kept.
+    """
+
+    def __init__(self):
+        # Whether profiling is on. When off, profiled code only pays for checking this.
+        self.enabled: bool = False
+        # Where to write profile artifacts
+        self.directory: str = "profiles"
+        # How many artifacts to keep
+        self.retain: int = 50
+        # Per-thread stack of active sections
+        self.__local = threading.local()
+        # Number of outermost sections currently tracing memory
+        self.__tracing: int = 0
+        # Whether a CPU profile is running (in any thread)
+        self.__cpu_profiling: bool = False
+        # Makes artifact names unique
+        self.__count: int = 0
+        self.__lock = threading.Lock()
+
+    def configure(self, enabled: bool, directory: str = "profiles", retain: int = 50) -> None:
+        """
+        Sets up profiling.
+        :param enabled: Whether to profile.
+        :param directory: Where to write profile artifacts.
+        :param retain: How many artifacts to keep.
+        :return: None.
+        """
+        self.enabled = enabled
+        self.directory = directory
+        self.retain = retain
+
+    @contextmanager
+    def section(self, label: str) -> Iterator[None]:
+        """
+        Profiles a section of code.
+        :param label: The name of the section, used in artifact names.
+        :return: A context manager around the section.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stack: List[Tuple[str, float, list]] = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = self.__local.stack = []
+        start = time.perf_counter()
+        if stack:
+            # Nested (or recursive) sections are timed as part of the outermost one
+            stack.append((label, start, stack[0][2]))
+            try:
+                yield
+            finally:
+                stack.pop()
+                stack[0][2].append((label, len(stack), time.perf_counter() - start))
+            return
+
+        sections: list = []
+        stack.append((label, start, sections))
+        # Only imported when profiling, so startup doesn't pay for them
+        import cProfile
+        import tracemalloc
+
+        profile: Union[cProfile.Profile, None] = None
+        tracing = started = False
+        try:
+            self._start_tracing()
+            tracing = True
+            if self._claim_cpu_profile():
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except BaseException:
+                    self._release_cpu_profile()
+                    profile = None
+                    raise
+            started = True
+            yield
+        finally:
+            # Only undo what was started, so a failure to start doesn't leave memory tracing on
+            if profile is not None:
+                profile.disable()
+                self._release_cpu_profile()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if tracing else 0
+            if tracing:
+                self._stop_tracing()
+            stack.pop()
+            if started:
+                try:
+                    self._write(label, profile, elapsed, peak, sections)
+                except OSError as exc:
+                    print(f"Unable to write profile for {label}: {exc}")
+
+    def bind(self, func: Callable) -> Callable:
+        """
+        Wraps a function that will run on another thread (e.g. in an executor) so its sections are timed
+        as part of the section running here, instead of each starting a profile of its own.
+        :param func: The function.
+        :return: The wrapped function.
+        """
+        stack = getattr(self.__local, "stack", None)
+        parent = stack[0] if self.enabled and stack else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if parent is None:
+                return func(*args, **kwargs)
+            previous = getattr(self.__local, "stack", None)
+            self.__local.stack = [parent]
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.__local.stack = previous
+        return wrapper
+
+    def _claim_cpu_profile(self) -> bool:
+        """
+        Claims the CPU profiler, since Python only allows one to run at a time.
+        :return: True if it was free.
+        """
+        with self.__lock:
+            if self.__cpu_profiling:
+                return False
+            self.__cpu_profiling = True
+            return True
+
+    def _release_cpu_profile(self) -> None:
+        """
+        Frees the CPU profiler for other sections.
+        :return: None.
+        """
+        with self.__lock:
+            self.__cpu_profiling = False
+
+    def _start_tracing(self) -> None:
+        """
+        Starts tracing memory allocations if no other section is.
+        :return: None.
+        """
+        import tracemalloc
+
+        with self.__lock:
+            if self.__tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.__tracing += 1
+
+    def _stop_tracing(self) -> None:
+        """
+        Stops tracing memory allocations once no section needs it.
+        :return: None.
+        """
+        import tracemalloc
+
+        with self.__lock:
+            self.__tracing -= 1
+            if self.__tracing == 0:
+                tracemalloc.stop()
+
+    def _write(self,
+               label: str,
+               profile: Union["cProfile.Profile", None],
+               elapsed: float,
+               peak: int,
+               sections: list) -> None:
+        """
+        Writes the artifacts of an outermost section and removes old ones.
+        :param label: The name of the section.
+        :param profile: The CPU profile of the section, or None if it was only timed.
+        :param elapsed: Wall time of the section in seconds.
+        :param peak: Peak traced memory during the section in bytes.
+        :param sections: (label, depth, seconds) of nested sections.
+        :return: None.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self.__lock:
+            self.__count += 1
+            count = self.__count
+        safe_label = re.sub(r"[^\w.-]+", "_", label)
+        stem = os.path.join(self.directory, f"{datetime.now():%Y%m%d-%H%M%S}-{count:04d}-{safe_label}")
+        import io
+        import pstats
+
+        stats_text = io.StringIO()
+        if profile is not None:
+            profile.dump_stats(stem + ".prof")
+            pstats.Stats(profile, stream=stats_text).sort_stats("cumulative").print_stats(30)
+        else:
+            stats_text.write("No CPU profile: another section was being profiled at the time.\n")
+        with open(stem + ".txt", "w") as summary_file:
+            summary_file.write(f"Section: {label}\n"
+                               f"Wall time: {elapsed:.3f} s\n"
+                               f"Peak traced memory: {peak / 2 ** 20:.2f} MiB\n")
+            if sections:
+                summary_file.write("\nNested sections (in order of completion):\n")
+                for section_label, depth, seconds in sections:
+                    summary_file.write(f"{'  ' * depth}{section_label}: {seconds:.3f} s\n")
+            summary_file.write("\n" + stats_text.getvalue())
+        self._prune()
+
+    def _prune(self) -> None:
+        """
+        Removes all but the newest `retain` artifacts.
+        :return: None.
+        """
+        stems = sorted({
+            os.path.splitext(entry.name)[0] for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith((".prof", ".txt"))
+        })
+        for stem in stems[:max(len(stems) - self.retain, 0)]:
+            for extension in (".prof", ".txt"):
+                try:
+                    os.remove(os.path.join(self.directory, stem + extension))
+                except FileNotFoundError:
+                    pass
+
+
+# Shared by everything in the bot
+profiler = Profiler()
+
+
+def profiled(label: str) -> Callable:
+    """
+    Decorator that profiles each call of a function with the shared profiler.
+    :param label: The name of the section.
+    :return: The decorator.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.section(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator